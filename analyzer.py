@@ -0,0 +1,146 @@
+import argparse
+import sys
+
+from decoder import INSTRUCTIONS, RET, EXIT, SYS, JP, CALL, SE, SNE, SE_V, SNE_V, LD_I, JP_V0, SKP, SKNP, INVALID
+
+
+# handlers that may skip the next instruction
+SKIPS = { SE, SNE, SE_V, SNE_V, SKP, SKNP }
+
+
+# Static analysis of a rom, done without running it. Follows the control
+# flow from the entry point: jumps and calls are followed, skips continue at
+# both the next and the one after, returns, 00FD and jumps end a path. BNNN
+# follows NNN, the start of its jump table. Builds an index of reachable
+# instructions, subroutine entry points, jump and data targets and the data
+# regions never reached as code, and lists problems found on the way
+#
+# A state() saved earlier (by the rom cache) can be passed in instead of
+# walking the rom again
+class Analysis():
+    def __init__(self,rom_bytes,base=0x200,state=None):
+        self.rom  = rom_bytes
+        self.base = base
+        # addresses of instructions reached from the entry point
+        self.code = set()
+        # entry points of 2NNN subroutines
+        self.subroutines = set()
+        # (address, kind) of every jump, call, BNNN table and ANNN pointer
+        # target, in the order the walk found them. kind is "jump", "call",
+        # "table" or "data"
+        self.targets = []
+        # (address, opcode, reason) of every problem found, by address
+        self.problems = []
+        if state is not None:
+            code, subroutines, self.targets, self.problems = state
+            self.code, self.subroutines = set(code), set(subroutines)
+            return
+        self.walk()
+        self.problems.sort(key=lambda problem: problem[0])
+
+    # the index and problems as plain lists and tuples, for marshal
+    def state(self):
+        return (sorted(self.code),sorted(self.subroutines),self.targets,self.problems)
+
+    # opcode at an address, None past the end of the rom
+    def fetch(self,addr):
+        i = addr - self.base
+        if i < 0 or i + 1 >= len(self.rom):
+            return None
+        return (self.rom[i] << 8) | self.rom[i+1]
+
+    # true if an address is inside the rom
+    def in_rom(self,addr):
+        return self.base <= addr < self.base + len(self.rom)
+
+    # walks every path from the entry point marking instructions and targets
+    def walk(self):
+        code     = self.code
+        targets  = self.targets
+        problems = self.problems
+        todo     = [self.base]
+        while todo:
+            addr = todo.pop()
+            while addr not in code:
+                opcode = self.fetch(addr)
+                if opcode is None:
+                    problems.append((addr,None,"runs off the end of the rom"))
+                    break
+                inst = INSTRUCTIONS[opcode]
+                h    = inst.handler
+                nnn  = inst.nnn
+                if h == INVALID:
+                    problems.append((addr,opcode,"malformed opcode"))
+                    break
+                code.add(addr)
+                if h == SYS:
+                    problems.append((addr,opcode,"machine code call (0NNN), ignored"))
+                if h in (JP,CALL,JP_V0) and not self.in_rom(nnn):
+                    problems.append((addr,opcode,"target outside the rom"))
+                if h in (RET,EXIT):
+                    break
+                if h == JP:
+                    targets.append((nnn,"jump"))
+                    addr = nnn
+                    continue
+                if h == CALL:
+                    self.subroutines.add(nnn)
+                    targets.append((nnn,"call"))
+                    todo.append(nnn)
+                elif h == JP_V0:
+                    targets.append((nnn,"table"))
+                    todo.append(nnn)
+                    break
+                elif h == LD_I:
+                    targets.append((nnn,"data"))
+                elif h in SKIPS:
+                    todo.append(addr + 4)
+                addr += 2
+
+    # (start, end) address ranges of the rom never reached as code
+    def data(self):
+        regions = []
+        code    = self.code
+        end     = self.base + len(self.rom)
+        addr    = self.base
+        while addr < end:
+            if addr in code:
+                addr += 2
+                continue
+            start = addr
+            while addr < end and addr not in code:
+                addr += 1
+            regions.append((start,addr))
+        return regions
+
+    # opcodes of the reachable instructions
+    def opcodes(self):
+        return { self.fetch(addr) for addr in self.code }
+
+    # text summary of the index and the problems
+    def report(self):
+        data  = self.data()
+        lines = [f"{len(self.code)} instructions reachable, {len(self.subroutines)} subroutines, "
+                 f"{sum(end - start for start,end in data)} bytes of data in {len(data)} regions"]
+        if self.subroutines:
+            lines.append("subroutines: " + " ".join(f"0x{addr:03x}" for addr in sorted(self.subroutines)))
+        for addr,opcode,reason in self.problems:
+            lines.append(f"0x{addr:03x}  {'----' if opcode is None else f'{opcode:04x}'}  {reason}")
+        return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    # argument parsing
+    parser = argparse.ArgumentParser(description="Check Chip 8 roms without running them, exits with 1 if any has problems")
+    parser.add_argument("roms",nargs='+',help="paths to .ch8 files")
+    parser.add_argument("--rom_base",type=int,default=0x200,help="base address the rom is loaded at")
+    args = parser.parse_args()
+
+    failed = False
+    for rom in args.roms:
+        with open(rom,"rb") as f:
+            analysis = Analysis(f.read(),args.rom_base)
+        print(f"; {rom}")
+        print(analysis.report())
+        failed = failed or bool(analysis.problems)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,96 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from emulator import Emulator
+from quirks import PROFILES
+from romcache import RomCache
+
+
+# why a headless run can't make progress anymore, None while it still can
+def halt_reason(emulator):
+    pc = emulator.pc
+    opcode = (emulator.memory[pc] << 8) | emulator.memory[pc+1]
+    if opcode == 0x1000 | pc:
+        return "jump to self"
+    if opcode & 0xf0ff == 0xf00a:
+        return "waiting for key"
+    if opcode == 0x00fd:
+        return "exit"
+    return None
+
+
+# runs one rom headless for up to cycles instructions, a frame at a time so
+# halts are noticed, and returns its result. runs in a worker process
+def run_rom(job):
+    path, seed, cycles, rom_base, ipf, cache, quirks = job
+    result = { "rom" : path, "seed" : seed, "cycles" : 0, "halt" : None, "error" : None }
+    emulator = None
+    start = time.perf_counter()
+    try:
+        with open(path,"rb") as f:
+            data = f.read()
+        emulator = Emulator(data,cycles_per_frame=ipf,seed=seed,cache=RomCache(cache) if cache else None,
+                            quirks=PROFILES[quirks])
+        emulator.load(base=rom_base)
+        while emulator.cycles < cycles:
+            emulator.run(min(ipf,cycles - emulator.cycles))
+            result["halt"] = halt_reason(emulator)
+            if result["halt"]:
+                break
+        result["framebuffer"] = hashlib.blake2b(emulator.grid,digest_size=8).hexdigest()
+        emulator.save_cache()
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    if emulator is not None:
+        result["cycles"] = emulator.cycles
+    elapsed = time.perf_counter() - start
+    result["ips"] = result["cycles"] / elapsed if elapsed else 0.0
+    return result
+
+
+# one job per rom in a directory, or one per seed for a single rom
+def jobs(path,seeds,cycles,rom_base,ipf,cache=None,quirks="chip8"):
+    if os.path.isdir(path):
+        roms = sorted(glob.glob(os.path.join(path,"**","*.ch8"),recursive=True))
+        return [ (rom,0,cycles,rom_base,ipf,cache,quirks) for rom in roms ]
+    return [ (path,seed,cycles,rom_base,ipf,cache,quirks) for seed in range(seeds) ]
+
+
+# runs jobs across worker processes, yielding results in job order
+def run_batch(jobs,workers=None):
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(run_rom,jobs,chunksize=max(1,len(jobs) // (4 * (workers or os.cpu_count() or 1))))
+
+
+if __name__ == '__main__':
+    # argument parsing
+    parser = argparse.ArgumentParser(description="Run many Chip 8 roms headless in parallel")
+    parser.add_argument("path",help="directory of .ch8 files, or a single .ch8 file to run with many seeds")
+    parser.add_argument("--cycles",type=int,default=100000,help="most instructions to run per rom")
+    parser.add_argument("--seeds",type=int,default=1,help="seeds to run a single rom with")
+    parser.add_argument("--workers",type=int,default=None,help="worker processes (default: one per core)")
+    parser.add_argument("--rom_base",type=int,default=0x200,help="base address for rom to be loaded into")
+    parser.add_argument("--ipf",type=int,default=50,help="instructions per 60 Hz frame")
+    parser.add_argument("--quirks",choices=sorted(PROFILES),default="chip8",help="interpreter behaviours the roms expect (default: chip8)")
+    parser.add_argument("--cache",default=None,help="directory to cache rom analysis and compiled code in, shared by the workers")
+    parser.add_argument("--json",action='store_true',default=False,help="print one JSON object per run")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    total = failed = 0
+    for result in run_batch(jobs(args.path,args.seeds,args.cycles,args.rom_base,args.ipf,args.cache,args.quirks),args.workers):
+        total += 1
+        failed += result["error"] is not None
+        if args.json:
+            print(json.dumps(result))
+            continue
+        status = result["error"] or result["halt"] or "ok"
+        print(f"{result['rom']:<32} seed={result['seed']:<4} {result.get('framebuffer','-'):<16} "
+              f"{result['cycles']:>10} cycles {result['ips']:>12,.0f} instructions/s  {status}")
+    if not args.json:
+        print(f"{total} runs, {failed} errors in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,179 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from emulator import Emulator, CYCLES_PER_FRAME
+from quirks import CHIP8
+
+
+# assembles a list of opcodes and data bytes into a rom
+def assemble(code,data=b""):
+    return b"".join(op.to_bytes(2,'big') for op in code) + bytes(data)
+
+
+# synthetic draw-heavy rom: 15-row sprites drawn over and over across the screen
+def sprite_storm():
+    code = [0xa20a, 0xd01f, 0x7003, 0x7105, 0x1202]
+    sprite = [0xff, 0x81, 0xbd, 0xa5, 0xa5, 0xbd, 0x81, 0xff, 0x3c, 0x42, 0x99, 0xa5, 0x99, 0x42, 0x3c]
+    return assemble(code,sprite)
+
+
+# synthetic cpu-heavy rom: a tight loop over the 8XYN arithmetic and logic ops
+def alu_loop():
+    code = [
+        0x6001, 0x6103,                                 # LD V0, 1 / LD V1, 3
+        0x8014, 0x8125, 0x8011, 0x8012, 0x8013,         # ADD SUB OR AND XOR
+        0x8016, 0x801e, 0x8017, 0x8010, 0x7001,         # SHR SHL SUBN LD ADD
+        0x1204                                          # JP 0x204
+    ]
+    return assemble(code)
+
+
+# synthetic memory-heavy rom: FX55/FX65 block moves of 12 registers walking
+# I 64 steps of 40 bytes through memory (each move advances I by 12 under
+# the chip8 profile bench() runs, and FC1E by 16), then starting over
+def memory_moves():
+    code = [
+        0x6c10,                                         # LD VC, 0x10
+        0xa300,                                         # LD I, 0x300
+        0x6d00,                                         # LD VD, 0
+        0xfb55, 0xfb65,                                 # LD [I], VB / LD VB, [I]
+        0xfc1e,                                         # ADD I, VC
+        0x7d01,                                         # ADD VD, 1
+        0x4d40,                                         # SNE VD, 0x40
+        0x1202,                                         # JP 0x202
+        0x1206                                          # JP 0x206
+    ]
+    return assemble(code)
+
+
+# synthetic call-heavy rom: a subroutine that calls itself 12 deep, unwinds
+# and starts over
+def call_recursion():
+    code = [
+        0x6000,                                         # LD V0, 0
+        0x2206,                                         # CALL 0x206
+        0x1200,                                         # JP 0x200
+        0x7001,                                         # ADD V0, 1
+        0x300c,                                         # SE V0, 12
+        0x2206,                                         # CALL 0x206
+        0x00ee                                          # RET
+    ]
+    return assemble(code)
+
+
+# generated roms by the name they are reported under
+SYNTHETIC = {
+    "(alu loop)"      : alu_loop,
+    "(sprite storm)"  : sprite_storm,
+    "(memory moves)"  : memory_moves,
+    "(call recursion)": call_recursion,
+}
+
+
+# runs a rom headless frame by frame for a number of instructions. returns
+# instructions/second, the mean and worst frame time and the peak memory
+# allocated by the emulator, measured in a second, shorter run since
+# tracing allocations slows everything down. runs under the chip8 profile
+# so the workload doesn't change with the emulator's default
+def bench(data,cycles,ipf=CYCLES_PER_FRAME,memory_frames=300,quirks=CHIP8):
+    emulator = Emulator(data,cycles_per_frame=ipf,quirks=quirks)
+    emulator.load()
+    frames = max(1,cycles // ipf)
+    times  = []
+    clock  = time.perf_counter
+    start  = clock()
+    for i in range(frames):
+        frame_start = clock()
+        emulator.frame()
+        times.append(clock() - frame_start)
+    elapsed = clock() - start
+
+    tracemalloc.start()
+    emulator = Emulator(data,cycles_per_frame=ipf,quirks=quirks)
+    emulator.load()
+    for i in range(min(frames,memory_frames)):
+        emulator.frame()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    times.sort()
+    return {
+        "ips"           : frames * ipf / elapsed,
+        "frame_ms"      : 1000 * elapsed / frames,
+        "frame_p99_ms"  : 1000 * times[min(frames - 1,int(frames * 0.99))],
+        "frame_max_ms"  : 1000 * times[-1],
+        "peak_kb"       : peak / 1024,
+    }
+
+
+# short hash of the checked out revision, None outside a git checkout
+def revision():
+    try:
+        out = subprocess.run(["git","rev-parse","--short","HEAD"],capture_output=True,text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+# names of roms that got slower than a baseline's by more than tolerance
+def regressions(results,baseline,tolerance):
+    slower = []
+    for name,result in results.items():
+        old = baseline["results"].get(name)
+        if old is not None and result["ips"] < old["ips"] * (1 - tolerance):
+            slower.append(name)
+    return slower
+
+
+if __name__ == '__main__':
+    # argument parsing
+    parser = argparse.ArgumentParser(description="Chip 8 headless benchmark")
+    parser.add_argument("roms",nargs='*',help="paths to .ch8 files (default: ch8s/*.ch8 and the generated roms)")
+    parser.add_argument("--cycles",type=int,default=200000,help="instructions to run per rom")
+    parser.add_argument("--ipf",type=int,default=CYCLES_PER_FRAME,help="instructions per 60 Hz frame")
+    parser.add_argument("--json",default=None,help="write the results to a JSON file")
+    parser.add_argument("--baseline",default=None,help="JSON results of an earlier run to compare instructions/s against")
+    parser.add_argument("--tolerance",type=float,default=0.1,help="with --baseline, slowdown that counts as a regression (default: 0.1)")
+    args = parser.parse_args()
+
+    roms = {}
+    for rom in args.roms or sorted(glob.glob("ch8s/*.ch8")):
+        with open(rom,"rb") as f:
+            roms[rom] = f.read()
+    if not args.roms:
+        for name,generate in SYNTHETIC.items():
+            roms[name] = generate()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print(f"{'rom':<24} {'instructions/s':>14} {'frame ms':>9} {'p99 ms':>8} {'max ms':>8} {'peak KB':>9}")
+    results = {}
+    for name,data in roms.items():
+        result = bench(data,args.cycles,args.ipf)
+        results[name] = result
+        line = (f"{name:<24} {result['ips']:>14,.0f} {result['frame_ms']:>9.3f} {result['frame_p99_ms']:>8.3f} "
+                f"{result['frame_max_ms']:>8.3f} {result['peak_kb']:>9,.0f}")
+        if baseline is not None and name in baseline["results"]:
+            line += f" {100 * (result['ips'] / baseline['results'][name]['ips'] - 1):>+7.1f}%"
+        print(line)
+
+    if args.json:
+        with open(args.json,"w") as f:
+            json.dump({ "revision" : revision(), "python" : platform.python_version(),
+                        "cycles" : args.cycles, "ipf" : args.ipf, "results" : results },f,indent=2)
+    if baseline is not None:
+        slower = regressions(results,baseline,args.tolerance)
+        if slower:
+            print(f"slower than {baseline.get('revision') or args.baseline}: {', '.join(slower)}")
+            sys.exit(1)
@@ -0,0 +1,200 @@
+import hashlib
+import os
+import queue
+import struct
+import threading
+import zlib
+
+# raw stream: each frame is its width and height followed by one byte per
+# pixel (0 or 1), row by row
+RAW_FRAME = struct.Struct(">HH")
+# pixel value to 8-bit grayscale, lit pixels dark like in the window
+GRAY = bytes([0xff,0x00]) + bytes(254)
+# hundredths of a second per GIF frame, GIF can't do 1/60
+GIF_DELAY = 2
+
+
+# Captures every frame the emulator presents, without a window. Attaching
+# replaces the emulator's display() with one that hands the grid to the
+# sinks and then presents it as before, like the profiler replaces run().
+#
+# Sinks run on a background thread so the emulation thread never waits on
+# encoding or I/O. The grid is compared against the last frame in place and
+# only copied when it changed, an unchanged frame queues the same bytes again.
+# close() waits for the queued frames to be written
+class Capture():
+    def __init__(self,emulator,sinks):
+        self.emulator = emulator
+        self.sinks    = sinks
+        self.last     = None
+        self.frames   = queue.Queue()
+        self.thread   = threading.Thread(target=self.encode,daemon=True)
+        self.thread.start()
+        emulator.display = self.display
+
+    # queues the current frame and presents it
+    def display(self):
+        emu  = self.emulator
+        grid = emu.grid
+        last = self.last
+        if last is None or last[0] != grid:
+            last = self.last = (bytes(grid),emu.width,emu.height)
+        self.frames.put(last)
+        type(emu).display(emu)
+
+    # background thread: writes queued frames to every sink until close()
+    def encode(self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            for sink in self.sinks:
+                sink.write(*frame)
+
+    # puts the emulator's own display() back, waits for the queued frames
+    # and closes the sinks
+    def close(self):
+        if "display" in self.emulator.__dict__:
+            del self.emulator.display
+        self.frames.put(None)
+        self.thread.join()
+        for sink in self.sinks:
+            sink.close()
+
+
+# raw frames, see RAW_FRAME
+class RawSink():
+    def __init__(self,path):
+        self.out = open(path,"wb")
+
+    def write(self,grid,width,height):
+        self.out.write(RAW_FRAME.pack(width,height))
+        self.out.write(grid)
+
+    def close(self):
+        self.out.close()
+
+
+# one line per frame with a 64-bit hash of its pixels in hex, so two runs
+# can be compared frame by frame with diff
+class HashSink():
+    def __init__(self,path):
+        self.out = open(path,"w")
+
+    def write(self,grid,width,height):
+        self.out.write(hashlib.blake2b(grid,digest_size=8,person=RAW_FRAME.pack(width,height)).hexdigest() + "\n")
+
+    def close(self):
+        self.out.close()
+
+
+# a numbered grayscale PNG per frame in a directory
+class PngSink():
+    def __init__(self,directory):
+        self.directory = directory
+        self.count = 0
+        os.makedirs(directory,exist_ok=True)
+
+    def write(self,grid,width,height):
+        self.count += 1
+        with open(os.path.join(self.directory,f"frame_{self.count:06d}.png"),"wb") as f:
+            f.write(png(grid,width,height))
+
+    def close(self):
+        pass
+
+
+# all frames as one looping animated GIF, sized by the first frame. frames
+# of another resolution are scaled to it
+class GifSink():
+    def __init__(self,path):
+        self.out  = open(path,"wb")
+        self.size = None
+
+    def write(self,grid,width,height):
+        if self.size is None:
+            self.size = (width,height)
+            # header, logical screen with a 2 color global palette, looping forever
+            self.out.write(b"GIF89a" + struct.pack("<HHBBB",width,height,0x80,0,0))
+            self.out.write(b"\xff\xff\xff\x00\x00\x00")
+            self.out.write(b"\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00")
+        screen_width, screen_height = self.size
+        if (width,height) != self.size:
+            grid = scale(grid,width,height,screen_width,screen_height)
+        # frame delay, then the image covering the whole screen
+        self.out.write(struct.pack("<BBBBHBB",0x21,0xf9,4,0,GIF_DELAY,0,0))
+        self.out.write(b"\x2c" + struct.pack("<HHHHB",0,0,screen_width,screen_height,0))
+        data = lzw(grid,2)
+        self.out.write(b"\x02" + b"".join(bytes([len(data[i:i+255])]) + data[i:i+255] for i in range(0,len(data),255)) + b"\x00")
+
+    def close(self):
+        if self.size is not None:
+            self.out.write(b"\x3b")
+        self.out.close()
+
+
+# a one byte per pixel grid as an 8-bit grayscale PNG
+def png(grid,width,height):
+    gray = grid.translate(GRAY)
+    rows = b"".join(b"\x00" + gray[y*width:(y+1)*width] for y in range(height))
+    def chunk(kind,data):
+        return struct.pack(">I",len(data)) + kind + data + struct.pack(">I",zlib.crc32(kind + data))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR",struct.pack(">IIBBBBB",width,height,8,0,0,0,0)) +
+            chunk(b"IDAT",zlib.compress(rows)) + chunk(b"IEND",b""))
+
+
+# nearest neighbour scaling of a one byte per pixel grid
+def scale(grid,width,height,new_width,new_height):
+    columns = [x * width // new_width for x in range(new_width)]
+    rows = []
+    for y in range(new_height):
+        start = (y * height // new_height) * width
+        rows.append(bytes(grid[start + x] for x in columns))
+    return b"".join(rows)
+
+
+# GIF's variable code size LZW compression of pixel values below 2 ** min_size
+def lzw(pixels,min_size):
+    clear = 1 << min_size
+    end   = clear + 1
+    out   = bytearray()
+    bits  = 0
+    nbits = 0
+    size  = min_size + 1
+    codes = {}
+    next_code = end + 1
+
+    def emit(code):
+        nonlocal bits, nbits
+        bits  |= code << nbits
+        nbits += size
+        while nbits >= 8:
+            out.append(bits & 0xff)
+            bits  >>= 8
+            nbits -= 8
+
+    emit(clear)
+    prefix = pixels[0]
+    for pixel in pixels[1:]:
+        key  = (prefix << 8) | pixel
+        code = codes.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        emit(prefix)
+        if next_code < 4096:
+            codes[key] = next_code
+            next_code += 1
+            if next_code > 1 << size:
+                size += 1
+        else:
+            emit(clear)
+            codes.clear()
+            size = min_size + 1
+            next_code = end + 1
+        prefix = pixel
+    emit(prefix)
+    emit(end)
+    if nbits:
+        out.append(bits & 0xff)
+    return bytes(out)
@@ -0,0 +1,115 @@
+import argparse
+import asyncio
+import hashlib
+import random
+import time
+
+from emulator import LORES
+from movie import FRAME, NO_KEY
+from quirks import PROFILES
+from server import HELLO, KEYS, DELTA, END, SESSION, DELTA_HEADER, send, receive
+
+# digits of a binary number to pixel bytes
+PIXELS = bytes.maketrans(b"01",b"\x00\x01")
+
+
+# A remote session on a server.py server. Applies the DELTAs it receives to
+# its own copy of the display
+class Client():
+    def __init__(self,reader,writer):
+        self.reader = reader
+        self.writer = writer
+        self.width, self.height = LORES
+        self.grid   = bytearray(self.width * self.height)
+        # number of the last frame received, and why the session ended
+        self.frame  = None
+        self.ended  = None
+        self.deltas = 0
+
+    # starts a session on a server
+    @classmethod
+    async def connect(cls,host,port,rom_bytes,seed=0,cycles_per_frame=50,quirks=PROFILES["chip8"]):
+        reader, writer = await asyncio.open_connection(host,port)
+        mask = sum(1 << i for i,quirk in enumerate(quirks) if quirk)
+        send(writer,HELLO,SESSION.pack(seed,cycles_per_frame,mask) + bytes(rom_bytes))
+        return cls(reader,writer)
+
+    # keys held as a bitmask and a key pressed for FX0A
+    def keys(self,held,key=NO_KEY):
+        send(self.writer,KEYS,FRAME.pack(held,key))
+
+    # waits for the next DELTA and applies it. returns its frame number,
+    # None once the session ended
+    async def update(self):
+        while self.ended is None:
+            try:
+                kind, payload = await receive(self.reader)
+            except (asyncio.IncompleteReadError,ConnectionError):
+                self.ended = "disconnected"
+                break
+            if kind == END:
+                self.ended = payload.decode()
+                break
+            if kind != DELTA:
+                continue
+            self.frame, width, height = DELTA_HEADER.unpack_from(payload)
+            if (width,height) != (self.width,self.height):
+                self.width, self.height = width, height
+                self.grid = bytearray(width * height)
+            size = width // 8 + 1
+            for i in range(DELTA_HEADER.size,len(payload),size):
+                row  = payload[i]
+                bits = format(int.from_bytes(payload[i+1:i+size],'big'),f"0{width}b")
+                self.grid[row*width:(row+1)*width] = bytes(bits,"ascii").translate(PIXELS)
+            self.deltas += 1
+            return self.frame
+        return None
+
+    def close(self):
+        self.writer.close()
+
+
+# plays a rom for some seconds, pressing random keys now and then. returns
+# the client when it's done
+async def play(host,port,rom_bytes,seconds,seed,quirks,keys):
+    client = await Client.connect(host,port,rom_bytes,seed=seed,quirks=quirks)
+    rng = random.Random(seed)
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        try:
+            frame = await asyncio.wait_for(client.update(),end - time.perf_counter())
+        except asyncio.TimeoutError:
+            break
+        if frame is None:
+            break
+        if keys and rng.random() < 0.1:
+            key = rng.randrange(16)
+            client.keys(1 << key,key)
+    client.close()
+    return client
+
+
+async def main(args):
+    with open(args.rom,"rb") as f:
+        data = f.read()
+    clients = await asyncio.gather(*(play(args.host,args.port,data,args.seconds,args.seed + i,PROFILES[args.quirks],args.keys)
+                                     for i in range(args.clients)))
+    for i,client in enumerate(clients):
+        print(f"client {i:<5} {client.deltas:>6} deltas  last frame {client.frame}  "
+              f"display {hashlib.blake2b(client.grid,digest_size=8).hexdigest()}  {client.ended or 'ok'}")
+
+
+if __name__ == '__main__':
+    # argument parsing
+    parser = argparse.ArgumentParser(description="Play a rom on a server.py server from many clients at once")
+    parser.add_argument("rom",help="path to .ch8 file")
+    parser.add_argument("--host",default="127.0.0.1",help="server address")
+    parser.add_argument("--port",type=int,default=8088,help="server port")
+    parser.add_argument("--clients",type=int,default=1,help="sessions to run at once")
+    parser.add_argument("--seconds",type=float,default=10,help="how long to play")
+    parser.add_argument("--seed",type=int,default=0,help="seed of the first session, the others count up from it")
+    parser.add_argument("--quirks",choices=sorted(PROFILES),default="chip8",help="interpreter behaviours the rom expects (default: chip8)")
+    parser.add_argument("--keys",action='store_true',default=False,help="press random keys")
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,226 @@
+import cmd
+import signal
+
+from decoder import INSTRUCTIONS, CALL, text
+
+
+# parses an address typed at the prompt, hex with or without 0x
+def number(arg):
+    return int(arg,16) if not arg.startswith(("0x","0X")) else int(arg,0)
+
+
+# parses a count typed at the prompt, decimal unless it starts with 0x
+def count(arg):
+    return int(arg) if not arg.startswith(("0x","0X")) else int(arg,0)
+
+
+# Interactive debugger: pc breakpoints, memory and register watchpoints,
+# single step, step over 2NNN and inspecting registers and memory.
+#
+# The emulator only runs an instrumented loop while something needs it: as
+# soon as a breakpoint, watchpoint or step-over target exists, the
+# emulator's run() is replaced with one that checks them around every
+# instruction, and once none are left the block/trace run() is put back. A
+# session without breakpoints runs at full speed until interrupted
+class Debugger(cmd.Cmd):
+    prompt = "(chip8) "
+    intro  = "Chip 8 debugger, type help for commands"
+
+    def __init__(self,emulator):
+        cmd.Cmd.__init__(self)
+        self.emulator = emulator
+        self.breakpoints = set()
+        # (start, end, contents) per watched memory range
+        self.memory_watches = []
+        # watched register names: "V0".."VF" and "I"
+        self.register_watches = set()
+        # (pc, stack depth) to stop at for step over
+        self.stop_at = None
+        # why the last run stopped, None while nothing stopped it
+        self.hit = None
+        # set when a command resumes, so the instruction it stopped on runs
+        self.resuming = False
+        self.show()
+
+    # a malformed argument prints the command's usage instead of ending the session
+    def onecmd(self,line):
+        try:
+            return cmd.Cmd.onecmd(self,line)
+        except ValueError:
+            method = getattr(self,"do_" + (self.parseline(line)[0] or ""),None)
+            print(f"usage: {method.__doc__}" if method is not None and method.__doc__ else f"bad argument: {line}")
+
+    # swaps the instrumented run() in or out depending on what is set
+    def update(self):
+        needed = self.breakpoints or self.memory_watches or self.register_watches or self.stop_at
+        installed = "run" in self.emulator.__dict__
+        if needed and not installed:
+            self.emulator.run = self.run
+        elif installed and not needed:
+            del self.emulator.run
+
+    # runs for a number of instructions like Emulator.run, stopping early when
+    # a breakpoint, watchpoint or step-over target is reached. the first
+    # instruction after resuming always runs, so a breakpoint doesn't stick
+    def run(self,cycles):
+        emu    = self.emulator
+        assert( emu.loaded == True )
+        V      = emu.V
+        memory = emu.memory
+        n      = emu.cycles
+        target = n + cycles
+        while n < target:
+            pc = emu.pc
+            if not self.resuming:
+                if pc in self.breakpoints:
+                    self.hit = f"breakpoint at 0x{pc:03x}"
+                    break
+                if self.stop_at == (pc,len(emu.stack)):
+                    self.hit = "stepped over"
+                    break
+            self.resuming = False
+            before = (bytes(V),emu.I)
+            emu.step()
+            n += 1
+            emu.cycles = n
+            emu.catch_up(n)
+            for name in self.register_watches:
+                old = before[1] if name == "I" else before[0][int(name[1],16)]
+                new = emu.I if name == "I" else V[int(name[1],16)]
+                if old != new:
+                    self.hit = f"{name} changed 0x{old:02x} -> 0x{new:02x} at 0x{pc:03x}"
+            for i,(start,end,contents) in enumerate(self.memory_watches):
+                if memory[start:end] != contents:
+                    self.hit = f"memory 0x{start:03x}-0x{end-1:03x} written at 0x{pc:03x}"
+                    self.memory_watches[i] = (start,end,bytes(memory[start:end]))
+            if self.hit:
+                break
+
+    # runs frames until something stops it or Ctrl-C. Ctrl-C only sets a flag
+    # checked between frames: interrupting a block or compiled trace midway
+    # would leave pc, the registers and the cycle count out of step
+    def resume(self):
+        emu = self.emulator
+        self.hit = None
+        self.resuming = True
+        interrupted = []
+        previous = signal.signal(signal.SIGINT,lambda signum,frame: interrupted.append(signum))
+        try:
+            while self.hit is None:
+                emu.frame()
+                if interrupted:
+                    self.hit = "interrupted"
+        finally:
+            signal.signal(signal.SIGINT,previous)
+        self.stop_at = None
+        self.update()
+        print(self.hit)
+        self.show()
+
+    # prints the registers and the next instruction through the emulator's debugger
+    def show(self):
+        emu = self.emulator
+        pc  = emu.pc
+        opcode = (emu.memory[pc] << 8) | emu.memory[pc+1]
+        emu.debugger(f"[{hex(pc)}]      0x{opcode:04x}",text(opcode))
+
+    def do_step(self,arg):
+        "step [count]: run one instruction, or count of them (decimal)"
+        cycles = count(arg) if arg else 1
+        self.hit = None
+        self.resuming = True
+        # step through the instrumented run so watchpoints still fire
+        self.run(cycles)
+        if self.hit:
+            print(self.hit)
+        self.show()
+
+    def do_next(self,arg):
+        "next: run one instruction, running a called subroutine through to its return"
+        emu = self.emulator
+        pc  = emu.pc
+        opcode = (emu.memory[pc] << 8) | emu.memory[pc+1]
+        if INSTRUCTIONS[opcode].handler != CALL:
+            return self.do_step("")
+        self.stop_at = (pc + 2,len(emu.stack))
+        self.update()
+        self.resume()
+
+    def do_continue(self,arg):
+        "continue: run until a breakpoint or watchpoint (Ctrl-C to stop)"
+        self.resume()
+
+    def do_break(self,arg):
+        "break [addr]: stop before executing addr, lists breakpoints without one"
+        if arg:
+            self.breakpoints.add(number(arg))
+            self.update()
+        print(" ".join(f"0x{addr:03x}" for addr in sorted(self.breakpoints)) or "no breakpoints")
+
+    def do_delete(self,arg):
+        "delete [addr]: remove the breakpoint at addr, or all of them"
+        if arg:
+            self.breakpoints.discard(number(arg))
+        else:
+            self.breakpoints.clear()
+        self.update()
+
+    def do_watch(self,arg):
+        "watch V3 | I | addr[-end]: stop when a register or memory range changes"
+        memory = self.emulator.memory
+        name = arg.upper()
+        if name == "I" or (len(name) == 2 and name[0] == "V" and name[1] in "0123456789ABCDEF"):
+            self.register_watches.add(name)
+        elif arg:
+            start, _, end = arg.partition("-")
+            start = number(start)
+            end   = number(end) + 1 if end else start + 1
+            self.memory_watches.append((start,end,bytes(memory[start:end])))
+        self.update()
+        watches = sorted(self.register_watches) + [f"0x{start:03x}-0x{end-1:03x}" for start,end,_ in self.memory_watches]
+        print(" ".join(watches) or "no watchpoints")
+
+    def do_unwatch(self,arg):
+        "unwatch: remove every watchpoint"
+        self.register_watches.clear()
+        self.memory_watches.clear()
+        self.update()
+
+    def do_regs(self,arg):
+        "regs: show registers, timers and the stack"
+        emu = self.emulator
+        self.show()
+        print(f"delay: {emu.delay_timer}  sound: {emu.sound_timer}  cycles: {emu.cycles}")
+        print("stack: " + " ".join(f"0x{addr:03x}" for addr in emu.stack))
+
+    def do_mem(self,arg):
+        "mem [addr] [length]: hex dump length bytes (decimal) from addr (hex, default I)"
+        memory = self.emulator.memory
+        args   = arg.split()
+        start  = number(args[0]) if args else self.emulator.I
+        length = count(args[1]) if len(args) > 1 else 64
+        for row in range(start,min(start + length,len(memory)),16):
+            data = memory[row:min(row + 16,start + length)]
+            print(f"0x{row:03x}  " + " ".join(f"{b:02x}" for b in data))
+
+    def do_dis(self,arg):
+        "dis [addr] [count]: disassemble count instructions (decimal) from addr (hex, default pc)"
+        memory = self.emulator.memory
+        args   = arg.split()
+        addr   = number(args[0]) if args else self.emulator.pc
+        lines  = count(args[1]) if len(args) > 1 else 10
+        for pc in range(addr,min(addr + 2 * lines,len(memory) - 1),2):
+            opcode = (memory[pc] << 8) | memory[pc+1]
+            marker = "*" if pc in self.breakpoints else ">" if pc == self.emulator.pc else " "
+            print(f"{marker} 0x{pc:03x}  {opcode:04x}  {text(opcode)}")
+
+    def do_quit(self,arg):
+        "quit: leave the debugger"
+        return True
+
+    do_s = do_step
+    do_n = do_next
+    do_c = do_continue
+    do_b = do_break
+    do_q = do_quit
+    do_EOF = do_quit
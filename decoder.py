@@ -0,0 +1,91 @@
+from collections import namedtuple
+
+# Instruction kinds. Every opcode decodes to one of these handler ids,
+# INVALID for opcodes that aren't instructions
+(
+    CLS, RET, SYS, JP, CALL, SE, SNE, SE_V, LD, ADD,
+    LD_V, OR, AND, XOR, ADD_V, SUB, SHR, SUBN, SHL, SNE_V,
+    LD_I, JP_V0, RND, DRW, SKP, SKNP, LD_DT_V, LD_K, LD_V_DT, LD_V_ST,
+    ADD_I, LD_F, LD_B, LD_MEM, LD_REGS, SCD, SCR, SCL, EXIT, LOW,
+    HIGH, LD_HF, LD_R, LD_V_R, INVALID
+) = range(45)
+
+# assembly syntax per handler id, formatted with (x, y, n, nn, nnn)
+SYNTAX = [
+    "CLS", "RET", "SYS 0x{4:03x}", "JP 0x{4:03x}", "CALL 0x{4:03x}",
+    "SE V{0:X}, 0x{3:02x}", "SNE V{0:X}, 0x{3:02x}", "SE V{0:X}, V{1:X}", "LD V{0:X}, 0x{3:02x}", "ADD V{0:X}, 0x{3:02x}",
+    "LD V{0:X}, V{1:X}", "OR V{0:X}, V{1:X}", "AND V{0:X}, V{1:X}", "XOR V{0:X}, V{1:X}", "ADD V{0:X}, V{1:X}",
+    "SUB V{0:X}, V{1:X}", "SHR V{0:X}, V{1:X}", "SUBN V{0:X}, V{1:X}", "SHL V{0:X}, V{1:X}", "SNE V{0:X}, V{1:X}",
+    "LD I, 0x{4:03x}", "JP V0, 0x{4:03x}", "RND V{0:X}, 0x{3:02x}", "DRW V{0:X}, V{1:X}, {2}", "SKP V{0:X}",
+    "SKNP V{0:X}", "LD V{0:X}, DT", "LD V{0:X}, K", "LD DT, V{0:X}", "LD ST, V{0:X}",
+    "ADD I, V{0:X}", "LD F, V{0:X}", "LD B, V{0:X}", "LD [I], V{0:X}", "LD V{0:X}, [I]", "SCD {2}",
+    "SCR", "SCL", "EXIT", "LOW", "HIGH", "LD HF, V{0:X}", "LD R, V{0:X}", "LD V{0:X}, R", "DW 0x{5:04x}"
+]
+
+# opcode pattern per handler id
+PATTERNS = [
+    "00E0", "00EE", "0NNN", "1NNN", "2NNN", "3XNN", "4XNN", "5XY0", "6XNN", "7XNN",
+    "8XY0", "8XY1", "8XY2", "8XY3", "8XY4", "8XY5", "8XY6", "8XY7", "8XYE", "9XY0",
+    "ANNN", "BNNN", "CXNN", "DXYN", "EX9E", "EXA1", "FX07", "FX0A", "FX15", "FX18",
+    "FX1E", "FX29", "FX33", "FX55", "FX65", "00CN", "00FB", "00FC", "00FD", "00FE",
+    "00FF", "FX30", "FX75", "FX85", "????"
+]
+
+# mnemonic per handler id
+MNEMONICS = [ syntax.split(" ")[0] for syntax in SYNTAX ]
+
+# instructions the frame scheduler charges per handler id. the emulator
+# counts every instruction as one, including ones that wait (FX0A)
+CYCLES = [1] * len(SYNTAX)
+
+# SUPER-CHIP handlers of 00NN by NN, besides 00CN
+SYSTEM = { 0xe0 : CLS, 0xee : RET, 0xfb : SCR, 0xfc : SCL, 0xfd : EXIT, 0xfe : LOW, 0xff : HIGH }
+# handlers of 8XYN by N, EXNN and FXNN by NN
+ALU  = { 0x0 : LD_V, 0x1 : OR, 0x2 : AND, 0x3 : XOR, 0x4 : ADD_V, 0x5 : SUB, 0x6 : SHR, 0x7 : SUBN, 0xe : SHL }
+KEYS = { 0x9e : SKP, 0xa1 : SKNP }
+MISC = {
+    0x07 : LD_DT_V, 0x0a : LD_K, 0x15 : LD_V_DT, 0x18 : LD_V_ST, 0x1e : ADD_I,
+    0x29 : LD_F, 0x30 : LD_HF, 0x33 : LD_B, 0x55 : LD_MEM, 0x65 : LD_REGS, 0x75 : LD_R, 0x85 : LD_V_R
+}
+
+# handlers of the classes that don't need more than the high nibble
+BY_CLASS = [None, JP, CALL, SE, SNE, SE_V, LD, ADD, None, SNE_V, LD_I, JP_V0, RND, DRW]
+
+# one decoded opcode: handler id, mnemonic, operand fields and cycle cost
+Instruction = namedtuple("Instruction","handler mnemonic x y n nn nnn cycles")
+
+
+# handler id of an opcode
+def handler(opcode):
+    n   = opcode & 0x000f
+    nn  = opcode & 0x00ff
+    cmd = opcode >> 12
+    if cmd == 0x0:
+        if opcode & 0xfff0 == 0x00c0:
+            return SCD
+        return SYSTEM.get(opcode,SYS) if opcode <= 0xff else SYS
+    if cmd in (0x5,0x9) and n != 0:
+        return INVALID
+    if cmd == 0x8:
+        return ALU.get(n,INVALID)
+    if cmd == 0xe:
+        return KEYS.get(nn,INVALID)
+    if cmd == 0xf:
+        return MISC.get(nn,INVALID)
+    return BY_CLASS[cmd]
+
+
+def decode(opcode):
+    h = handler(opcode)
+    return Instruction(h,MNEMONICS[h],(opcode & 0x0f00) >> 8,(opcode & 0x00f0) >> 4,
+                       opcode & 0x000f,opcode & 0x00ff,opcode & 0x0fff,CYCLES[h])
+
+
+# every opcode decoded once at import, decoding is a lookup from here on
+INSTRUCTIONS = [ decode(opcode) for opcode in range(0x10000) ]
+
+
+# assembly text of an opcode
+def text(opcode):
+    inst = INSTRUCTIONS[opcode]
+    return SYNTAX[inst.handler].format(inst.x,inst.y,inst.n,inst.nn,inst.nnn,opcode)
@@ -1,62 +1,139 @@
-import pygame
-from pygame.locals import *
 import random
-import time
-import sys
+import struct
+from array import array
+
+from analyzer import Analysis
+from decoder import (INSTRUCTIONS, text, CLS, RET, JP, CALL, SE, SNE, SE_V, LD, ADD,
+                     LD_V, OR, AND, XOR, ADD_V, SUB, SHR, SUBN, SHL, SNE_V, LD_I, JP_V0, RND,
+                     DRW, SKP, SKNP, LD_DT_V, LD_K, LD_V_DT, LD_V_ST, ADD_I, LD_F, LD_B,
+                     LD_MEM, LD_REGS, SCD, SCR, SCL, EXIT, LOW, HIGH, LD_HF, LD_R, LD_V_R)
+from frontend import HeadlessFrontend
+from jit import Jit, JIT_THRESHOLD
+from quirks import CHIP8
+
+from_bytes = int.from_bytes
+
+# instructions executed per 60 Hz frame, the timers tick once per frame
+CYCLES_PER_FRAME = 50
+# snapshot header: format version, cycles, pc, I, delay timer, sound timer,
+# stack depth, words of rng state (0 when the state has none) and 1 for the
+# SUPER-CHIP hi-res display
+STATE = struct.Struct(">BQHHBBHHB")
+STATE_VERSION = 2
+# longest straight-line run of instructions decoded into one block
+BLOCK_SIZE = 32
+# built in hex digit sprites, 5 bytes each
+FONTS = [
+    0xF0, 0x90, 0x90, 0x90, 0xF0, # 0
+    0x20, 0x60, 0x20, 0x20, 0x70, # 1
+    0xF0, 0x10, 0xF0, 0x80, 0xF0, # 2
+    0xF0, 0x10, 0xF0, 0x10, 0xF0, # 3
+    0x90, 0x90, 0xF0, 0x10, 0x10, # 4
+    0xF0, 0x80, 0xF0, 0x10, 0xF0, # 5
+    0xF0, 0x80, 0xF0, 0x90, 0xF0, # 6
+    0xF0, 0x10, 0x20, 0x40, 0x40, # 7
+    0xF0, 0x90, 0xF0, 0x90, 0xF0, # 8
+    0xF0, 0x90, 0xF0, 0x10, 0xF0, # 9
+    0xF0, 0x90, 0xF0, 0x90, 0x90, # A
+    0xE0, 0x90, 0xE0, 0x90, 0xE0, # B
+    0xF0, 0x80, 0x80, 0x80, 0xF0, # C
+    0xE0, 0x90, 0x90, 0x90, 0xE0, # D
+    0xF0, 0x80, 0xF0, 0x80, 0xF0, # E
+    0xF0, 0x80, 0xF0, 0x80, 0x80  # F
+]
+# SUPER-CHIP 8x10 decimal digit sprites, 10 bytes each, loaded after FONTS
+BIG_FONTS = [
+    0x3C, 0x7E, 0xE7, 0xC3, 0xC3, 0xC3, 0xC3, 0xE7, 0x7E, 0x3C, # 0
+    0x18, 0x38, 0x58, 0x18, 0x18, 0x18, 0x18, 0x18, 0x18, 0x3C, # 1
+    0x3E, 0x7F, 0xC3, 0x06, 0x0C, 0x18, 0x30, 0x60, 0xFF, 0xFF, # 2
+    0x3C, 0x7E, 0xC3, 0x03, 0x0E, 0x0E, 0x03, 0xC3, 0x7E, 0x3C, # 3
+    0x06, 0x0E, 0x1E, 0x36, 0x66, 0xC6, 0xFF, 0xFF, 0x06, 0x06, # 4
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFC, 0xFE, 0x03, 0xC3, 0x7E, 0x3C, # 5
+    0x3E, 0x7C, 0xE0, 0xC0, 0xFC, 0xFE, 0xC3, 0xC3, 0x7E, 0x3C, # 6
+    0xFF, 0xFF, 0x03, 0x06, 0x0C, 0x18, 0x30, 0x60, 0x60, 0x60, # 7
+    0x3C, 0x7E, 0xC3, 0xC3, 0x7E, 0x7E, 0xC3, 0xC3, 0x7E, 0x3C, # 8
+    0x3C, 0x7E, 0xC3, 0xC3, 0x7F, 0x3F, 0x03, 0x03, 0x3E, 0x7C  # 9
+]
+# display sizes: the original and SUPER-CHIP's hi-res mode
+LORES = (64,32)
+HIRES = (128,64)
 
-# RGB color constants
-BLACK = [255,255,255]
-WHITE = [0,0,0]
 
 # Chip 8 emulator
 class Emulator():
-    def __init__(self,rom_bytes,debug = False):
+    def __init__(self,rom_bytes,debug = False,frontend = None,jit = True,cycles_per_frame = CYCLES_PER_FRAME,seed = None,cache = None,quirks = CHIP8):
 
         assert(len(rom_bytes) < 0x4096)
         self.debug   = debug
         self.rom     = rom_bytes
-        self.memory  = [0]*4096
+        self.memory  = bytearray(4096)
         self.stack   = []
         self.pc      = 0x200
         self.I       = 0x0
         self.loaded  = False
         # 16 registers
-        self.V = [0 for i in range(16)]
+        self.V = bytearray(16)
 
-        # Display
-        self.grid = [ [ 1 for i in range(64) ] for i in range(32) ]
-        self.scale = 10
-        self.width = 64
-        self.height = 32
-        self.clock = pygame.time.Clock()
-        self.screen = self.init_display()
+        # Display, one byte per pixel row by row: grid[y * width + x]. 64x32,
+        # or 128x64 in SUPER-CHIP hi-res mode. resize() changes the grid in
+        # place, so the handlers and frontend can hold on to it
+        self.width, self.height = LORES
+        self.grid = bytearray(b"\x01" * (self.width * self.height))
 
         # Keyboard
-        self.init_keyboard()
+        # 0 = keyup / 1 = keydown
+        self.keypresses = {
+            1   : 0, 2 : 0, 3   : 0, 0xc : 0,
+            4   : 0, 5 : 0, 6   : 0, 0xd : 0,
+            7   : 0, 8 : 0, 9   : 0, 0xe : 0,
+            0xa : 0, 0 : 0, 0xb : 0, 0xf : 0
+        }
+
+        # SUPER-CHIP RPL user flags, saved and loaded by FX75/FX85
+        self.flags = bytearray(16)
+
+        # random numbers for CXNN, per machine so save states can include
+        # them and a seed makes runs repeatable
+        self.random = random.Random(seed)
 
         # Timers
         self.delay_timer = 0
         self.sound_timer = 0
 
         # Fonts
-        self.fonts = [ 
-        0xF0, 0x90, 0x90, 0x90, 0xF0, # 0
-        0x20, 0x60, 0x20, 0x20, 0x70, # 1
-        0xF0, 0x10, 0xF0, 0x80, 0xF0, # 2
-        0xF0, 0x10, 0xF0, 0x10, 0xF0, # 3
-        0x90, 0x90, 0xF0, 0x10, 0x10, # 4
-        0xF0, 0x80, 0xF0, 0x10, 0xF0, # 5
-        0xF0, 0x80, 0xF0, 0x90, 0xF0, # 6
-        0xF0, 0x10, 0x20, 0x40, 0x40, # 7
-        0xF0, 0x90, 0xF0, 0x90, 0xF0, # 8
-        0xF0, 0x90, 0xF0, 0x10, 0xF0, # 9
-        0xF0, 0x90, 0xF0, 0x90, 0x90, # A
-        0xE0, 0x90, 0xE0, 0x90, 0xE0, # B
-        0xF0, 0x80, 0x80, 0x80, 0xF0, # C
-        0xE0, 0x90, 0x90, 0x90, 0xE0, # D
-        0xF0, 0x80, 0xF0, 0x80, 0xF0, # E
-        0xF0, 0x80, 0xF0, 0x80, 0x80  # F
-        ]
+        self.fonts = FONTS + BIG_FONTS
+
+        # Interpreter behaviours the handlers are built for, see quirks.py
+        self.quirks = quirks
+
+        # Decoded handlers by opcode, filled in as opcodes are first seen
+        self.ops = {}
+        # Basic blocks keyed by start address, and how many blocks cover each byte
+        self.blocks = [None] * 4096
+        self.code   = array('H',bytes(2 * 4096))
+        self.cycles = 0
+        # 60 Hz timer ticks applied so far, one per frame of cycles_per_frame
+        # instructions. fixed for the emulator's lifetime, compiled traces use it
+        self.ticks  = 0
+        self.cycles_per_frame = cycles_per_frame
+        # Compiled traces keyed by entry address, and block executions per address
+        self.jit      = Jit(self) if jit else None
+        self.traces   = [None] * 4096
+        self.compiled = {}
+        self.heat     = [0] * 4096
+        # Rewind history recorded every frame, None when not recording
+        self.history  = None
+        # Static analysis of the rom, made by load()
+        self.analysis = None
+        # Rom cache (a RomCache or None) and the entry load() found in it
+        self.cache    = cache
+        self.cached   = None
+        if self.debug:
+            self.step = self.trace_step
+
+        # Frontend (display, input and timing), headless unless one is given
+        self.frontend = frontend if frontend is not None else HeadlessFrontend()
+        self.frontend.attach(self)
 
     # load fonts and rom into memory
     def load(self,base=0x200, font=0x50):
@@ -65,16 +142,44 @@ class Emulator():
         self.rom_base = base
         self.font_base = font
         # load fonts
-        for n in range(len(self.fonts)):
-            self.memory[n+font] = self.fonts[n]
-        
+        self.memory[font:font+len(self.fonts)] = bytes(self.fonts)
+
         # load rom
-        for i in range(len(self.rom)):
-            self.memory[i+base] = self.rom[i]
+        self.memory[base:base+len(self.rom)] = self.rom
+        self.invalidate(0,len(self.memory))
+
+        # index the reachable code, from the rom cache if it has it, and
+        # decode its handlers before running
+        if self.cache is not None:
+            self.cache_key = self.cache.key(self.rom,base,self.cycles_per_frame,self.quirks)
+            self.cached = self.cache.get(self.cache_key)
+        if self.cached is not None:
+            self.analysis = Analysis(self.rom,base,self.cached.analysis)
+        else:
+            self.analysis = Analysis(self.rom,base)
+        for opcode in self.analysis.opcodes():
+            if opcode not in self.ops:
+                self.decode(opcode)
 
         self.pc = base
         self.loaded = True
 
+    # writes the analysis and compiled traces to the rom cache, unless it
+    # already had all of them
+    def save_cache(self):
+        if self.cache is None or not self.loaded:
+            return
+        artifacts = self.jit.artifacts if self.jit is not None else {}
+        if self.cached is not None and artifacts.keys() <= self.cached.index.keys():
+            return
+        self.cache.put(self.cache_key,self.analysis,artifacts)
+
+    # switches the display size, clearing it. the grid keeps its identity
+    def resize(self,width,height):
+        self.width  = width
+        self.height = height
+        self.grid[:] = bytes(width * height)
+
     # prints debug info in a disassembly format
     def debugger(self,curr_pc,debug_str):
         sep = "-" * 80
@@ -86,322 +191,573 @@ class Emulator():
         print(debug_str)
         print(sep)
 
-    # initialized pygame display 
-    def init_display(self):
-        pygame.init()
-        pygame.time.set_timer(pygame.USEREVENT+1, int(1000 / 60))
-        screen = pygame.display.set_mode([self.width * self.scale, self.height * self.scale])
-        screen.fill(BLACK)
-        pygame.display.flip()
-        return screen
-    
-    # initializes keyboard
-    # https://www.pygame.org/docs/ref/key.html
-    def init_keyboard(self):
-        '''
-        Chip8       My Keys
-        ---------   ---------
-        1 2 3 C     1 2 3 4
-        4 5 6 D     q w e r
-        7 8 9 E     a s d f
-        A 0 B F     z x c v
-        '''
-        # { physical key : emulated chip8 key}
-        self.keybindings = {
-            K_1 : 1,   K_2 : 2, K_3 : 3,   K_4 : 0xc,
-            K_q : 4,   K_w : 5, K_e : 6,   K_r : 0xd,
-            K_a : 7,   K_s : 8, K_d : 9,   K_f : 0xe,
-            K_z : 0xa, K_x : 0, K_c : 0xb, K_v : 0xf,
-            K_ESCAPE : K_ESCAPE # workaround pygame.quit() not working 
-        }
-        # 0 = keyup / 1 = keydown
-        self.keypresses = {
-            1   : 0, 2 : 0, 3   : 0, 0xc : 0,
-            4   : 0, 5 : 0, 6   : 0, 0xd : 0,
-            7   : 0, 8 : 0, 9   : 0, 0xe : 0,
-            0xa : 0, 0 : 0, 0xb : 0, 0xf : 0
-        }
-
-    # handles pygame events
+    # handles input events through the frontend
     def keyboard_handler(self):
-        # iterate through every pygame event
-        for event in pygame.event.get():
-            # this event doesn't seem to work
-            # instead make keybinding to quit
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                pygame.display.quit()
-                sys.exit()
-            elif event.type == pygame.USEREVENT + 1:
-                self.delay_timer -= 1
-            # if key is pressed
-            elif event.type == pygame.KEYDOWN:
-                try:
-                    if self.keybindings[event.key] == K_ESCAPE:
-                        pygame.quit()
-                        pygame.display.quit()
-                        sys.exit()
-                    target = self.keybindings[event.key]
-                    self.keypresses[target] = 1
-                except:
-                    print(f"[x] {event.key} maybe not be binded to a physical key")
-            # if key is released
-            elif event.type == pygame.KEYUP:
-                try:
-                    target = self.keybindings[event.key]
-                    self.keypresses[target] = 0
-                except:
-                    print(f"[x] {event.key} maybe not be binded to a physical key")
-        
+        self.frontend.poll()
+
     # draws display based on state of grid
     def display(self):
-        # iterate through every element ("pixel") in grid and color pixel based on value
-        # 1 = WHITE / 0 = BLACK
-        for i in range(0,len(self.grid)):
-            for j in range(0,len(self.grid[0])):
-                cellColor = BLACK
-                if self.grid[i][j] == 1:
-                    cellColor = WHITE
-                pygame.draw.rect(self.screen, cellColor, [j * self.scale, i * self.scale, self.scale, self.scale], 0)
-        pygame.display.flip()
-    
-    # emulator's main loop
-    def loop(self):
+        self.frontend.present()
+
+    # emulator's main loop, forever or for a number of instructions
+    def loop(self,cycles=None):
         assert( self.loaded == True )
-        while True:
-            self.parse(self.memory[self.pc:self.pc+2])
-            self.clock.tick(3000)
-            self.keyboard_handler()
-            self.display()
+        target = None if cycles is None else self.cycles + cycles
+        while target is None or self.cycles < target:
+            self.frame(target)
+
+    # runs one 60 Hz frame: input is polled once, a frame's worth of
+    # instructions runs (ticking the timers at its end), the display is
+    # presented and the frontend waits for the next frame. while the
+    # frontend is rewinding, the frame steps back through the history instead
+    def frame(self,target=None):
+        count = self.cycles_per_frame - self.cycles % self.cycles_per_frame
+        if target is not None:
+            count = min(count,target - self.cycles)
+        self.keyboard_handler()
+        if self.history is not None and self.frontend.rewinding:
+            self.history.back()
+        else:
+            self.run(count)
+            if self.history is not None:
+                self.history.record()
+        self.display()
+        self.frontend.tick()
+
+    # executes the instruction at pc
+    def step(self):
+        pc = self.pc
+        opcode = (self.memory[pc] << 8) | self.memory[pc+1]
+        self.pc = pc + 2
+        op = self.ops.get(opcode)
+        if op is None:
+            op = self.decode(opcode)
+        op()
+
+    # same as step() but prints every instruction through the debugger
+    def trace_step(self):
+        pc = self.pc
+        opcode = (self.memory[pc] << 8) | self.memory[pc+1]
+        Emulator.step(self)
+        curr_pc = "[{}]      0x{:04x}".format(hex(pc),opcode)
+        self.debugger(curr_pc,text(opcode))
+
+    # runs for a number of instructions without throttling, ticking the
+    # timers at 60 Hz of emulated time
+    def run(self,cycles):
+        assert( self.loaded == True )
+        target = self.cycles + cycles
+        if self.debug:
+            while self.cycles < target:
+                self.step()
+                self.cycles += 1
+                self.catch_up(self.cycles)
+            return
+        blocks = self.blocks
+        traces = self.traces
+        heat   = self.heat
+        per_frame = self.cycles_per_frame
+        # heat never reaches -1, so nothing gets compiled without a jit
+        threshold = JIT_THRESHOLD if self.jit is not None else -1
+        n = self.cycles
+        while n < target:
+            # run whole blocks up to the next timer tick, single stepping
+            # whatever doesn't fit. compiled traces apply the ticks they
+            # cross themselves, so they may run past it
+            limit = min(target, (n // per_frame + 1) * per_frame)
+            while n < limit:
+                pc = self.pc
+                trace = traces[pc]
+                if trace is not None:
+                    done = trace(target - n,n)
+                    if done:
+                        n += done
+                        continue
+                block = blocks[pc]
+                if block is None:
+                    block = self.compile_block(pc)
+                ops, end, count = block
+                if n + count > limit:
+                    self.step()
+                    n += 1
+                    continue
+                heat[pc] += 1
+                if heat[pc] == threshold:
+                    self.compile_trace(pc)
+                self.pc = end
+                for op in ops:
+                    op()
+                n += count
+            self.catch_up(n)
+        self.cycles = n
+
+    # applies the timer ticks due before the instruction with the given index
+    def catch_up(self,cycles):
+        due = cycles // self.cycles_per_frame
+        while self.ticks < due:
+            self.ticks += 1
+            self.tick_timers()
+
+    # decodes the straight-line run of instructions starting at pc into a
+    # block that runs as one unit. blocks end after anything that changes pc
+    # or writes memory, so only the last handler can leave the block
+    def compile_block(self,start):
+        memory = self.memory
+        ops    = self.ops
+        block  = []
+        pc     = start
+        while len(block) < BLOCK_SIZE:
+            # an instruction can't start on the last byte, a block starting
+            # there raises like step() would instead of coming out empty
+            if block and pc >= len(memory) - 1:
+                break
+            opcode = (memory[pc] << 8) | memory[pc+1]
+            op = ops.get(opcode)
+            if op is None:
+                # let a malformed first instruction raise like step() would
+                if block:
+                    try:
+                        op = self.decode(opcode)
+                    except AssertionError:
+                        break
+                else:
+                    op = self.decode(opcode)
+            block.append(op)
+            pc += 2
+            if ends_block(opcode):
+                break
+        for addr in range(start,pc):
+            self.code[addr] += 1
+        self.blocks[start] = (tuple(block), pc, len(block))
+        return self.blocks[start]
+
+    # compiles the hot code starting at pc into a trace, falling back to the
+    # interpreter when the jit can't handle its first instruction
+    def compile_trace(self,pc):
+        trace = self.jit.compile(pc)
+        if trace is None:
+            return
+        for addr in trace.addrs:
+            self.code[addr]   += 1
+            self.code[addr+1] += 1
+        self.traces[pc]   = trace
+        self.compiled[pc] = trace
+
+    # drops every cached block and compiled trace that overlaps memory[start:end]
+    def invalidate(self,start,end):
+        code = self.code
+        if not any(code[start:end]):
+            return
+        blocks = self.blocks
+        for pc in range(max(0,start - 2 * BLOCK_SIZE),min(end,len(blocks))):
+            block = blocks[pc]
+            if block is not None and block[1] > start:
+                blocks[pc] = None
+                for addr in range(pc,block[1]):
+                    code[addr] -= 1
+        for pc,trace in list(self.compiled.items()):
+            if any(addr < end and addr + 2 > start for addr in trace.addrs):
+                del self.compiled[pc]
+                self.traces[pc] = None
+                self.heat[pc]   = 0
+                for addr in trace.addrs:
+                    code[addr]   -= 1
+                    code[addr+1] -= 1
+
+    # decrements the delay and sound timers
+    def tick_timers(self):
+        if self.delay_timer > 0:
+            self.delay_timer -= 1
+        if self.sound_timer > 0:
+            self.sound_timer -= 1
+
+    # packs the whole machine state into one bytes object: the header, the
+    # stack, the rng state, then V, the RPL flags, memory and grid as they are
+    # in memory
+    def snapshot(self):
+        rng    = self.random.getstate()[1]
+        header = STATE.pack(STATE_VERSION,self.cycles,self.pc,self.I & 0xffff,self.delay_timer,
+                            self.sound_timer,len(self.stack),len(rng),(self.width,self.height) == HIRES)
+        stack  = struct.pack(f">{len(self.stack)}H",*self.stack)
+        return b"".join((header,stack,struct.pack(f">{len(rng)}I",*rng),self.V,self.flags,self.memory,self.grid))
+
+    # restores a state made by snapshot(), copying into the existing buffers
+    def restore(self,state):
+        view = memoryview(state)
+        version,self.cycles,self.pc,self.I,self.delay_timer,self.sound_timer,depth,words,hires = STATE.unpack_from(view)
+        assert( version == STATE_VERSION )
+        if (self.width,self.height) != (HIRES if hires else LORES):
+            self.resize(*(HIRES if hires else LORES))
+        self.ticks = self.cycles // self.cycles_per_frame
+        offset = STATE.size
+        self.stack = list(struct.unpack_from(f">{depth}H",view,offset))
+        offset += 2 * depth
+        if words:
+            self.random.setstate((3,struct.unpack_from(f">{words}I",view,offset),None))
+            offset += 4 * words
+        for buf in (self.V,self.flags,self.memory,self.grid):
+            chunk = view[offset:offset+len(buf)]
+            if buf is self.memory and buf != chunk:
+                buf[:] = chunk
+                self.invalidate(0,len(buf))
+            else:
+                buf[:] = chunk
+            offset += len(buf)
 
-    # parses and executes instructions at pc
+    # parses and executes an instruction given as two bytes
     def parse(self,codes):
         # codes = [pc:pc+2]
-        # get opcode by combining both bytes 
-        opcode    = (codes[0] << 8) | codes[1]
-        curr_pc   = "[{}]      0x{:04x}".format(hex(self.pc),opcode)
-        debug_str = ""
-
-        # get command from most signicate byte
-        cmd = opcode >> 12      
-        if cmd == 0x0:
-            if opcode == 0x00e0:
-                self.grid = [ [ 0 for i in range(64) ] for i in range(32) ] 
-                debug_str = "Clear the screen"
-            elif opcode == 0x00ee:
-                self.pc = self.stack.pop()
-                debug_str = "Return from subroutine"
-            else:
-                val = opcode & 0x0fff
-                self.pc  = val
-                debug_str = f"Execute at addr {hex(val)}"
-        # if in 0x1NNN bucket
-        elif cmd == 0x1:
-            val = opcode & 0x0fff
-            self.pc = val - 2
-            debug_str = f"Jump to address {hex(val)}"
-        # if in 0x2NNN bucket
-        elif cmd == 0x2:
-            val = opcode & 0x0fff
-            self.stack.append(val)
-            debug_str = f"Execute subroutine at address {hex(val)}"
-        # if in 0x3NNN bucket
-        elif cmd == 0x3:
-            regx = (opcode & 0x0f00) >> 8
-            nn = opcode & 0x00ff
-            if self.V[regx] == nn:
-                self.pc += 2
-            debug_str = f"Skip following instruction if V{regx} == {hex(opcode & 0x00ff)}"
-        # if in 0x4NNN bucket
-        elif cmd == 0x4:
-            regx = (opcode & 0x0f00) >> 8
-            nn = opcode & 0x00ff
-            if self.V[regx] != nn:
-                self.pc += 2
-            debug_str = f"Skip following instruction if V{regx} != {hex(opcode & 0x00ff)}"
-        # if in 0x5NNN bucket
-        elif cmd == 0x5:
-            assert( (opcode & 0x000f) == 0)
-            regx = (opcode & 0x0f00) >> 8
-            regy = (opcode & 0x00f0) >> 4
-            if self.V[regx] == self.V[regy]:
-                self.pc += 2
-            debug_str = f"Skip following instruction if V{regx} == V{regy}"
-        # if in 0x6NNN bucket
-        elif cmd == 0x6:
-            reg = (opcode & 0x0f00) >> 8
-            val = (opcode & 0x00ff)
-            self.V[reg] = val & 0xff
-            debug_str = f"Store {hex(val)} in V{reg}"
-        # if in 0x7NNN bucket
-        elif cmd == 0x7:
-            reg = (opcode & 0x0f00) >> 8
-            val = (opcode & 0x00ff)
-            self.V[reg] = (self.V[reg] + val) & 0xff
-            debug_str = f"Add {hex(val)} to V{reg}"  
-        # if in 0x8NNN bucket
-        elif cmd == 0x8:
-            index = opcode & 0xf
-            regx = (opcode & 0x0f00) >> 8
-            regy = (opcode & 0x00f0) >> 4
-            # Store
-            if index == 0x0:
-                self.V[regx] = self.V[regy]
-                debug_str = f"Store V{regy} in V{regx}"
-            # OR
-            if index == 0x1:
-                self.V[regx] |= self.V[regy]
-                debug_str = f"Store V{regx} | V{regy} in V{regx}"
-            # AND 
-            if index == 0x2:
-                self.V[regx] &= self.V[regy]
-                debug_str = f"Store V{regx} & V{regy} in V{regx}"
-            # XOR
-            if index == 0x3:
-                self.V[regx] ^= self.V[regy]
-                debug_str = f"Store V{regx} ^ V{regy} in V{regx}"
-            # ADD with carry
-            if index == 0x4:
-                self.V[regx] += self.V[regy]
-                self.V[0xf] = 0
-                if self.V[regx] > 0xff:
-                    self.V[0xf] = 1
-                    self.V[regx] = self.V[regx] & 0xff
-                debug_str = f"Store V{regx} + V{regy} in V{regx} and set carry flag"
-            # Check for borrow
-            if index == 0x5:
-                tmp = self.V[regx] - self.V[regy]
-                self.V[0xf] = 1
-                if tmp < 0:
-                    self.V[0xf] = 0
-                    self.V[regx] = abs(self.V[regx])
-                debug_str = f"Check if borrow occurs in V{regx}-V{regy} and set carry flag in Vf"
-            # Shift right 1 bit
-            if index == 0x6:
-                self.V[0xf]  = self.V[regy] & 0xf
-                self.V[regx] = self.V[regy] >> 1
-                debug_str = f"V{regx} = V{regy} >> 1 with least significant bit saved in Vf"
-            # SUB with borrow
-            if index == 0x7:
-                self.V[regx] -= self.V[regy]
-                self.V[0xf]   = 1
-                if self.V[regx] < 0:
-                    self.V[0xf]  = 0
-                    self.V[regx] = abs(self.V[regx])
-                debug_str = f"V{regx} -= V{regy} and set carry flag in Vf"
-            # Shift left 1 bit
-            if index == 0xe:
-                self.V[0xf]  = self.V[regy] >> 12
-                self.V[regx] = self.V[regy] << 1
-                debug_str = f"V{regx} = V{regy} << 1 with most significant bit saved in Vf"
-        # if in 0x9NNN bucket
-        elif cmd == 0x9:
-            if self.V[regx] != self.V[regy]:
-                self.pc += 2
-            debug_str = f"Skip following instruction if V{regx} != V{regy}"
-        # if in 0xANNN bucket
-        elif cmd == 0xA:
-            val = (opcode & 0x0fff)
-            self.I = val
-            debug_str = f"Store {hex(val)} in I"
-        # if in 0xBNNN bucket
-        elif cmd == 0xb:
-            val = opcode & 0x0fff
-            self.pc = val + self.V[0]
-            self.pc -= 2
-            debug_str = f"Jump to address {hex(val)} + V0"
-        # if in 0xCNNN bucket
-        elif cmd == 0xc:
-            val = opcode & 0x00ff
-            r = random.randint(0,255)
-            self.V[regx] = (r & val) & 0xff
-            debug_str = f"Set V{regx} to random number: {hex(r)} & {hex(val)}"
-        # if in 0xDNNN bucket
-        elif cmd == 0xd:
-            x = (opcode & 0x0f00) >> 8
-            y = (opcode & 0x00f0) >> 4
-            n = (opcode & 0x000f)
-            sprite = self.memory[self.I:self.I+n]
-            debug_str = f"Draw {n} bytes starting at ({self.V[x]},{self.V[y]}) reading from address I: {hex(self.I)}"
-            bns = []
-            # turn list of memory bytes into a list of lists of 8-bit binary numbers 
-            for val in sprite:
-                b = bin(val)[2:].zfill(8)
-                bns.append( [ int(b[i],2) for i in range(len(b)) ] )
-            # iterate through grid and edit "pixels" based on sprites
-            regx = self.V[x] & 0xff
-            regy = self.V[y] & 0xff
-            for i in range(len(bns)):
-                for j in range(len(bns[0])):
-                    self.grid[(regy+i)][(regx+j)] ^= bns[i][j]
-        # if in 0xENNN bucket
-        elif cmd == 0xe:
-            index = opcode & 0x00ff
-            regx  = (opcode & 0x0f00) >> 8
-            if index == 0x9e:
-                debug_str = f"Skip following instruction if key pressed = V{regx}"
-                for key in self.keypresses.keys():
-                    if keypresses[key] == self.V[regx]:
-                        self.pc += 2
-            if index == 0xa1:
-                debug_str = f"Skip following instruction if key pressed != V{regx}"
-                for key in self.keypresses.keys():
-                    if keypresses[key] != self.V[regx]:
-                        self.pc += 2
-        # if in 0xFNNN bucket
-        elif cmd == 0xf:
-            index = opcode & 0x00ff
-            regx  = (opcode & 0x0f00) >> 8
-            if index == 0x07:
-                debug_str = f"Store delay timer in V{regx}"
-                self.V[regx] = self.delay_timer & 0xff
-            # same as keyboard_handler() but it waits to make sure it captures a KEYDOWN event
-            if index == 0x0a:
-                pygame.event.clear()
-                while True:
-                    event = pygame.event.wait()
-                    if event.type == pygame.KEYDOWN:
-                        if event.key == K_ESCAPE:
-                            pygame.display.quit()
-                            pygame.quit()
-                            sys.exit()
-                        try:
-                            target = self.keybindings[event.key]
-                            debug_str = f"Waited for keypress {target} and store in V{regx}"
-                            self.V[regx] = target & 0xff
-                            break
-                        except:
-                            print(f"[x] {event.key} maybe be an invalid key. Try again!")
-            if index == 0x15:
-                debug_str = f"Set delay timer to value in V{regx}"
-                self.delay_timer = self.V[regx]
-            if index == 0x18:
-                debug_str = f"Set sound timer to value in V{regx}"
-                self.sound_timer = self.V[regx]
-            if index == 0x1e:
-                debug_str = f"Set I to I + V{regx}"
-                self.I += self.V[regx]
-            # get font
-            if index == 0x29:
-                debug_str = f"set I to address of hex-digit stored in fonts {self.font_base}"
-                self.I = self.font_base + (self.V[regx] * 5)
-            if index == 0x33:
-                # if V[3] = 0x9. dec = 009
-                debug_str = f"Store BCD stored in V{regx} into memory[I], memory[I+1], memory[I+2]"
-                dec = str(self.V[regx]).zill(3)
-                for i in range(len(dec)):
-                    self.memory[self.I + i] = int(dec[i])
-            if index == 0x55:
-                debug_str = f"Store values in V0 to V{regx} starting at memory[I]"
-                for i in range(regx+1):
-                   self.memory[self.I + i] = self.V[i] 
-            if index == 0x65:
-                debug_str = f"Fill registers V0 to V{regx} with values starting at memory[I]"
-                for i in range(regx+1):
-                    self.V[i] = self.memory[self.I + i] & 0xff
-        if self.debug == True:
-            self.debugger(curr_pc,debug_str)
-        # advances pc
+        # get opcode by combining both bytes
+        opcode = (codes[0] << 8) | codes[1]
         self.pc += 2
-    
+        op = self.ops.get(opcode)
+        if op is None:
+            op = self.decode(opcode)
+        op()
+
+    # builds the handler for an opcode with its operands already decoded and
+    # stores it in the dispatch table. handlers run with pc already pointing
+    # at the next instruction
+    def decode(self,opcode):
+        V      = self.V
+        memory = self.memory
+        quirks = self.quirks
+        inst = INSTRUCTIONS[opcode]
+        h    = inst.handler
+        x, y, n, nn, nnn = inst.x, inst.y, inst.n, inst.nn, inst.nnn
+
+        if h == CLS:
+            grid = self.grid
+            def op():
+                grid[:] = bytes(len(grid))
+        elif h == RET:
+            def op():
+                self.pc = self.stack.pop()
+        elif h == JP:
+            def op():
+                self.pc = nnn
+        elif h == CALL:
+            def op():
+                self.stack.append(self.pc)
+                self.pc = nnn
+        elif h == SE:
+            def op():
+                if V[x] == nn:
+                    self.pc += 2
+        elif h == SNE:
+            def op():
+                if V[x] != nn:
+                    self.pc += 2
+        elif h == SE_V:
+            def op():
+                if V[x] == V[y]:
+                    self.pc += 2
+        elif h == LD:
+            def op():
+                V[x] = nn
+        elif h == ADD:
+            def op():
+                V[x] = (V[x] + nn) & 0xff
+        # Store
+        elif h == LD_V:
+            def op():
+                V[x] = V[y]
+        elif h == OR and quirks.vf_reset:
+            def op():
+                V[x] |= V[y]
+                V[0xf] = 0
+        elif h == OR:
+            def op():
+                V[x] |= V[y]
+        elif h == AND and quirks.vf_reset:
+            def op():
+                V[x] &= V[y]
+                V[0xf] = 0
+        elif h == AND:
+            def op():
+                V[x] &= V[y]
+        elif h == XOR and quirks.vf_reset:
+            def op():
+                V[x] ^= V[y]
+                V[0xf] = 0
+        elif h == XOR:
+            def op():
+                V[x] ^= V[y]
+        # ADD with carry
+        elif h == ADD_V:
+            def op():
+                val = V[x] + V[y]
+                V[x] = val & 0xff
+                V[0xf] = 1 if val > 0xff else 0
+        # SUB with borrow
+        elif h == SUB:
+            def op():
+                val = V[x] - V[y]
+                V[x] = val & 0xff
+                V[0xf] = 0 if val < 0 else 1
+        # Shift right 1 bit, VF is the bit shifted out
+        elif h == SHR and quirks.shift:
+            def op():
+                flag = V[x] & 1
+                V[x] >>= 1
+                V[0xf] = flag
+        elif h == SHR:
+            def op():
+                flag = V[y] & 1
+                V[x] = V[y] >> 1
+                V[0xf] = flag
+        # reverse SUB with borrow
+        elif h == SUBN:
+            def op():
+                val = V[y] - V[x]
+                V[x] = val & 0xff
+                V[0xf] = 0 if val < 0 else 1
+        # Shift left 1 bit, VF is the bit shifted out
+        elif h == SHL and quirks.shift:
+            def op():
+                flag = V[x] >> 7
+                V[x] = (V[x] << 1) & 0xff
+                V[0xf] = flag
+        elif h == SHL:
+            def op():
+                flag = V[y] >> 7
+                V[x] = (V[y] << 1) & 0xff
+                V[0xf] = flag
+        elif h == SNE_V:
+            def op():
+                if V[x] != V[y]:
+                    self.pc += 2
+        elif h == LD_I:
+            def op():
+                self.I = nnn
+        elif h == JP_V0 and quirks.jump:
+            def op():
+                self.pc = nnn + V[x]
+        elif h == JP_V0:
+            def op():
+                self.pc = nnn + V[0]
+        elif h == RND:
+            randint = self.random.randint
+            def op():
+                V[x] = randint(0,255) & nn
+        # a 16x16 SUPER-CHIP sprite, two bytes a row, drawn as its left and
+        # right 8 pixel halves. without the quirk DXY0 draws nothing
+        elif h == DRW and n == 0 and quirks.sprite16:
+            grid = self.grid
+            clip = quirks.clip
+            draw = clip_blit if clip else blit
+            def op():
+                I = self.I
+                width  = self.width
+                height = self.height
+                sprite = memory[I:I+32]
+                hit = draw(grid,width,height,sprite[0::2],V[x],V[y])
+                if not clip or V[x] % width + 8 < width:
+                    hit |= draw(grid,width,height,sprite[1::2],V[x] + 8,V[y])
+                V[0xf] = hit
+        elif h == DRW:
+            grid = self.grid
+            draw = clip_blit if quirks.clip else blit
+            def op():
+                I = self.I
+                V[0xf] = draw(grid,self.width,self.height,memory[I:I+n],V[x],V[y])
+        elif h == SKP:
+            keypresses = self.keypresses
+            def op():
+                if keypresses[V[x] & 0xf] == 1:
+                    self.pc += 2
+        elif h == SKNP:
+            keypresses = self.keypresses
+            def op():
+                if keypresses[V[x] & 0xf] != 1:
+                    self.pc += 2
+        elif h == LD_DT_V:
+            def op():
+                V[x] = self.delay_timer & 0xff
+        # waits for a keypress from the frontend, re-executing until one arrives
+        elif h == LD_K:
+            def op():
+                target = self.frontend.wait_key()
+                if target is None:
+                    self.pc -= 2
+                else:
+                    V[x] = target & 0xff
+        elif h == LD_V_DT:
+            def op():
+                self.delay_timer = V[x]
+        elif h == LD_V_ST:
+            def op():
+                self.sound_timer = V[x]
+        elif h == ADD_I:
+            def op():
+                self.I += V[x]
+        # get font
+        elif h == LD_F:
+            def op():
+                self.I = self.font_base + (V[x] * 5)
+        # if V[3] = 0x9. dec = 009
+        elif h == LD_B:
+            def op():
+                val = V[x]
+                I = self.I
+                memory[I]   = val // 100
+                memory[I+1] = (val // 10) % 10
+                memory[I+2] = val % 10
+                self.invalidate(I,I+3)
+        # a slice past the end of memory would resize memory or V instead of
+        # failing, so going past it raises IndexError like FX33 does
+        elif h == LD_MEM and quirks.increment:
+            def op():
+                I = self.I
+                if I + x + 1 > 4096:
+                    raise IndexError("FX55 writes past the end of memory")
+                memory[I:I+x+1] = V[0:x+1]
+                self.I = I + x + 1
+                self.invalidate(I,I+x+1)
+        elif h == LD_MEM:
+            def op():
+                I = self.I
+                if I + x + 1 > 4096:
+                    raise IndexError("FX55 writes past the end of memory")
+                memory[I:I+x+1] = V[0:x+1]
+                self.invalidate(I,I+x+1)
+        elif h == LD_REGS and quirks.increment:
+            def op():
+                I = self.I
+                if I + x + 1 > 4096:
+                    raise IndexError("FX65 reads past the end of memory")
+                V[0:x+1] = memory[I:I+x+1]
+                self.I = I + x + 1
+        elif h == LD_REGS:
+            def op():
+                I = self.I
+                if I + x + 1 > 4096:
+                    raise IndexError("FX65 reads past the end of memory")
+                V[0:x+1] = memory[I:I+x+1]
+        # SUPER-CHIP scrolls move the whole grid with one slice copy and blank
+        # the rows or columns scrolled in: N rows down, 4 columns right or left
+        elif h == SCD:
+            grid = self.grid
+            def op():
+                shift = n * self.width
+                grid[shift:] = grid[:len(grid) - shift]
+                grid[:shift] = bytes(shift)
+        elif h == SCR:
+            grid = self.grid
+            def op():
+                width = self.width
+                grid[4:] = grid[:-4]
+                blank = bytes(self.height)
+                for column in range(4):
+                    grid[column::width] = blank
+        elif h == SCL:
+            grid = self.grid
+            def op():
+                width = self.width
+                grid[:-4] = grid[4:]
+                blank = bytes(self.height)
+                for column in range(width - 4,width):
+                    grid[column::width] = blank
+        # stops the interpreter: re-executes itself forever
+        elif h == EXIT:
+            def op():
+                self.pc -= 2
+        elif h == LOW:
+            def op():
+                self.resize(*LORES)
+        elif h == HIGH:
+            def op():
+                self.resize(*HIRES)
+        # get big font
+        elif h == LD_HF:
+            def op():
+                self.I = self.font_base + len(FONTS) + (V[x] * 10)
+        elif h == LD_R:
+            flags = self.flags
+            def op():
+                flags[0:x+1] = V[0:x+1]
+        elif h == LD_V_R:
+            flags = self.flags
+            def op():
+                V[0:x+1] = flags[0:x+1]
+        # a malformed 5XYN is an error, other invalid instructions and 0NNN
+        # machine code routines are ignored
+        else:
+            assert( opcode >> 12 != 0x5 )
+            def op():
+                pass
+        self.ops[opcode] = op
+        return op
+
+
+# every sprite byte expanded to 8 one-byte pixels, read as a big-endian int
+EXPAND = [ int.from_bytes(bytes((b >> (7 - i)) & 1 for i in range(8)),'big') for b in range(256) ]
+
+
+# XORs a sprite onto a one-byte-per-pixel grid, a whole 8-pixel row at a time.
+# the sprite starts at (left, top) wrapped onto the screen and its pixels wrap
+# around the edges. returns 1 if any lit pixel was turned off, else 0
+def blit(grid,width,height,sprite,left,top):
+    left %= width
+    top  %= height
+    hit  = 0
+    size = width * height
+    o    = top * width + left
+    # pixels that fit before the right edge, the rest wrap to the row start
+    fit  = width - left
+    if fit >= 8:
+        for byte in sprite:
+            if byte:
+                bits = EXPAND[byte]
+                old  = from_bytes(grid[o:o+8],'big')
+                hit |= old & bits
+                grid[o:o+8] = (old ^ bits).to_bytes(8,'big')
+            o += width
+            if o >= size:
+                o -= size
+        return 1 if hit else 0
+    wrap = 8 - fit
+    mask = (1 << (8 * wrap)) - 1
+    for byte in sprite:
+        if byte:
+            bits = EXPAND[byte]
+            part = bits >> (8 * wrap)
+            old  = from_bytes(grid[o:o+fit],'big')
+            hit |= old & part
+            grid[o:o+fit] = (old ^ part).to_bytes(fit,'big')
+            row  = o - left
+            bits &= mask
+            old  = from_bytes(grid[row:row+wrap],'big')
+            hit |= old & bits
+            grid[row:row+wrap] = (old ^ bits).to_bytes(wrap,'big')
+        o += width
+        if o >= size:
+            o -= size
+    return 1 if hit else 0
+
+
+# same as blit() for sprites clipped at the screen edges: only the start
+# position wraps, pixels past the right or bottom edge aren't drawn
+def clip_blit(grid,width,height,sprite,left,top):
+    left %= width
+    top  %= height
+    hit  = 0
+    o    = top * width + left
+    fit  = min(8,width - left)
+    drop = 8 * (8 - fit)
+    for byte in sprite[:height - top]:
+        if byte:
+            bits = EXPAND[byte] >> drop
+            old  = from_bytes(grid[o:o+fit],'big')
+            hit |= old & bits
+            grid[o:o+fit] = (old ^ bits).to_bytes(fit,'big')
+        o += width
+    return 1 if hit else 0
+
+
+# handlers that change pc or write memory end a basic block
+ENDS_BLOCK = { RET, JP, CALL, SE, SNE, SE_V, SNE_V, JP_V0, SKP, SKNP, LD_K, LD_B, LD_MEM, EXIT }
+
 
+def ends_block(opcode):
+    return INSTRUCTIONS[opcode].handler in ENDS_BLOCK
@@ -0,0 +1,237 @@
+import sys
+import time
+
+# pygame is only needed for the windowed frontend
+try:
+    import pygame
+except ImportError:
+    pygame = None
+
+# RGB color constants
+BLACK = [255,255,255]
+WHITE = [0,0,0]
+
+# seconds between presented frames
+FRAME_TIME = 1 / 60
+
+
+# Frontends own everything outside the CPU core: display, input and timing.
+# Once per frame the emulator calls poll() to refresh its keypresses,
+# present() to draw its grid and tick() to wait for the next frame.
+#
+# The base class paces frames and measures throughput. fps is the number of
+# emulated frames per second of host time, None runs them unthrottled. With
+# stats on, show() gets a readout of the last second about once a second.
+class Frontend():
+    def __init__(self,fps=None,stats=False):
+        self.fps   = fps
+        self.stats = stats
+        # true while the user holds the rewind key
+        self.rewinding = False
+
+    def attach(self,emulator):
+        self.emulator = emulator
+        self.frames   = 0
+        self.started  = (time.perf_counter(),time.process_time(),emulator.cycles,0)
+        self.last     = self.started
+        self.next_frame = self.started[0]
+
+    # waits until the next frame is due
+    def tick(self):
+        self.frames += 1
+        now = time.perf_counter()
+        if self.fps:
+            self.next_frame += 1 / self.fps
+            delay = self.next_frame - now
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -0.25:
+                # fell too far behind, don't try to catch up in a burst
+                self.next_frame = now
+        if self.stats and now - self.last[0] >= 1:
+            self.show(self.readout(self.last))
+            self.last = (now,time.process_time(),self.emulator.cycles,self.frames)
+
+    # instructions/second, frames/second and host cpu seconds since a
+    # (wall time, cpu time, cycles, frames) mark
+    def readout(self,since):
+        wall = max(time.perf_counter() - since[0],1e-9)
+        cpu  = time.process_time() - since[1]
+        ips  = (self.emulator.cycles - since[2]) / wall
+        fps  = (self.frames - since[3]) / wall
+        return f"{ips:,.0f} instructions/s  {fps:,.1f} frames/s  {cpu:.2f}s cpu"
+
+    # readout over the whole run
+    def summary(self):
+        return self.readout(self.started)
+
+    def show(self,readout):
+        print(readout)
+
+
+# runs without a window, input or pacing unless an fps is given
+class HeadlessFrontend(Frontend):
+
+    # nothing to draw
+    def present(self):
+        pass
+
+    # no input source, every key stays up
+    def poll(self):
+        pass
+
+    # no key will ever arrive, FX0A keeps waiting
+    def wait_key(self):
+        return None
+
+
+
+# pygame window and keyboard
+class PygameFrontend(Frontend):
+    def __init__(self,scale=10,fps=60,stats=False):
+        if pygame is None:
+            raise RuntimeError("pygame is required for the windowed frontend")
+        Frontend.__init__(self,fps,stats)
+        self.scale = scale
+        # chip8 key pressed since FX0A last asked, None if there wasn't one
+        self.pressed = None
+        self.init_keyboard()
+
+        # render metrics: frames presented, seconds spent on the last frame and in total
+        self.rendered     = 0
+        self.render_time  = 0.0
+        self.render_total = 0.0
+
+    def attach(self,emulator):
+        Frontend.attach(self,emulator)
+        self.screen = self.init_display()
+        # copy of the grid as last presented, 0xff so the first frame draws everything
+        self.shown = bytearray(b"\xff" * len(emulator.grid))
+        # host time the next present is due, see present()
+        self.next_present = 0.0
+
+    # initialized pygame display
+    def init_display(self):
+        pygame.init()
+        screen = pygame.display.set_mode([self.emulator.width * self.scale, self.emulator.height * self.scale])
+        screen.fill(BLACK)
+        pygame.display.flip()
+        return screen
+
+    # initializes keyboard
+    # https://www.pygame.org/docs/ref/key.html
+    def init_keyboard(self):
+        '''
+        Chip8       My Keys
+        ---------   ---------
+        1 2 3 C     1 2 3 4
+        4 5 6 D     q w e r
+        7 8 9 E     a s d f
+        A 0 B F     z x c v
+
+        hold backspace to rewind (with --rewind)
+        '''
+        # { physical key : emulated chip8 key}
+        self.keybindings = {
+            pygame.K_1 : 1,   pygame.K_2 : 2, pygame.K_3 : 3,   pygame.K_4 : 0xc,
+            pygame.K_q : 4,   pygame.K_w : 5, pygame.K_e : 6,   pygame.K_r : 0xd,
+            pygame.K_a : 7,   pygame.K_s : 8, pygame.K_d : 9,   pygame.K_f : 0xe,
+            pygame.K_z : 0xa, pygame.K_x : 0, pygame.K_c : 0xb, pygame.K_v : 0xf,
+            pygame.K_ESCAPE : pygame.K_ESCAPE, # workaround pygame.quit() not working
+            pygame.K_BACKSPACE : pygame.K_BACKSPACE # hold to rewind
+        }
+
+    def quit(self):
+        pygame.quit()
+        pygame.display.quit()
+        sys.exit()
+
+    # handles pygame events, once per frame
+    def poll(self):
+        keypresses = self.emulator.keypresses
+        self.pressed = None
+        # iterate through every pygame event
+        for event in pygame.event.get():
+            # this event doesn't seem to work
+            # instead make keybinding to quit
+            if event.type == pygame.QUIT:
+                self.quit()
+            # if key is pressed
+            elif event.type == pygame.KEYDOWN:
+                try:
+                    if self.keybindings[event.key] == pygame.K_ESCAPE:
+                        self.quit()
+                    if self.keybindings[event.key] == pygame.K_BACKSPACE:
+                        self.rewinding = True
+                        continue
+                    target = self.keybindings[event.key]
+                    keypresses[target] = 1
+                    self.pressed = target
+                except KeyError:
+                    print(f"[x] {event.key} maybe not be binded to a physical key")
+            # if key is released
+            elif event.type == pygame.KEYUP:
+                try:
+                    if self.keybindings[event.key] == pygame.K_BACKSPACE:
+                        self.rewinding = False
+                        continue
+                    target = self.keybindings[event.key]
+                    keypresses[target] = 0
+                except KeyError:
+                    print(f"[x] {event.key} maybe not be binded to a physical key")
+
+    # returns a key pressed since the last FX0A, without blocking. FX0A
+    # re-executes until one arrives so the timers and display keep running
+    def wait_key(self):
+        target = self.pressed
+        self.pressed = None
+        return target
+
+    # draws display based on state of grid, at most about once per 60 Hz
+    # frame and only when it changed since the last frame. presents are due
+    # every FRAME_TIME and may come up to half a frame early, so the jitter
+    # of frames paced at 1x doesn't drop any, and faster speeds are thinned
+    # out to 60 presents/s. the grid becomes a 2 color
+    # surface that is scaled onto the screen and only rows that differ from
+    # what is shown are sent to the display
+    def present(self):
+        start = time.perf_counter()
+        if start < self.next_present - FRAME_TIME / 2:
+            return
+        # after falling behind, the next present is due right away instead of in a burst
+        self.next_present = max(self.next_present + FRAME_TIME,start)
+        emulator = self.emulator
+        grid  = emulator.grid
+        shown = self.shown
+        if grid == shown:
+            return
+        width  = emulator.width
+        height = emulator.height
+        # a resolution switch keeps the window size and redraws everything
+        if len(shown) != len(grid):
+            shown[:] = b"\xff" * len(grid)
+        scale  = self.screen.get_height() // height
+        dirty  = []
+        for row in range(height):
+            i = row * width
+            if grid[i:i+width] != shown[i:i+width]:
+                dirty.append((0,row * scale,width * scale,scale))
+        shown[:] = grid
+
+        # 1 = WHITE / 0 = BLACK
+        surface = pygame.image.fromstring(bytes(grid),(width,height),"P")
+        surface.set_palette([BLACK,WHITE])
+        self.screen.blit(pygame.transform.scale(surface,self.screen.get_size()),(0,0))
+        pygame.display.update(dirty)
+
+        self.render_time   = time.perf_counter() - start
+        self.render_total += self.render_time
+        self.rendered     += 1
+
+    # live readout goes in the window title
+    def show(self,readout):
+        pygame.display.set_caption(f"Chip 8  {readout}")
+
+    def summary(self):
+        average = self.render_total / max(self.rendered,1) * 1000
+        return f"{Frontend.summary(self)}  {average:.2f}ms/render"
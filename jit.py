@@ -0,0 +1,381 @@
+
+from decoder import (INSTRUCTIONS, CLS, RET, JP, CALL, SE, SNE, SE_V, SNE_V, JP_V0,
+                     DRW, SKP, SKNP, LD_K, LD_B, LD_MEM, SCD, SCR, SCL, EXIT, LOW, HIGH,
+                     LD_HF, LD_R, LD_V_R, INVALID)
+from romcache import signature
+
+# block executions before a trace is compiled
+JIT_THRESHOLD = 32
+# most instructions followed into one trace
+TRACE_SIZE = 64
+
+# register names used as locals in generated code
+REGS = [f"v{i:x}" for i in range(16)]
+
+
+# Compiles hot traces of CHIP-8 code into Python functions. A trace starts at
+# a block entry and follows straight-line code through the fall-through side
+# of skips and through unconditional jumps. Jumping back to the entry becomes
+# a while loop, so tight delay and polling loops run entirely in generated
+# code with the registers held in locals. Anything that can't be compiled
+# ends the trace and goes back to the interpreter at that pc.
+#
+# With a rom cache, compiled code is looked up there by the trace's signature
+# before generating it, and everything compiled is kept in artifacts for
+# Emulator.save_cache() to write back
+class Jit():
+    def __init__(self,emulator):
+        self.emulator = emulator
+        # (source, code object) by (entry, signature), only kept with a rom cache
+        self.artifacts = {}
+
+    # returns fn(budget,cycles) running at most budget instructions from entry,
+    # where cycles is the emulator's instruction count on entry, and returning
+    # how many ran. None when nothing at entry can be compiled
+    def compile(self,entry):
+        trace = self.trace(entry)
+        if trace[0][0] == 'exit':
+            return None
+        emulator = self.emulator
+        cached = None
+        if emulator.cache is not None:
+            key = (entry,signature(trace))
+            if emulator.cached is not None:
+                cached = emulator.cached.trace(*key)
+        if cached is not None:
+            source, code = cached
+        else:
+            source = self.generate(entry,trace)
+            code = compile(source,f"<jit 0x{entry:03x}>","exec")
+        if emulator.cache is not None:
+            self.artifacts[key] = (source,code)
+        namespace = {
+            'emu'        : emulator,
+            'V'          : emulator.V,
+            'memory'     : emulator.memory,
+            'keypresses' : emulator.keypresses,
+            'randint'    : emulator.random.randint,
+        }
+        # interpreter handlers called from the trace
+        for kind,pc,opcode in trace:
+            if kind in ('call','last'):
+                namespace[f"op_{opcode:04x}"] = emulator.ops.get(opcode) or emulator.decode(opcode)
+        exec(code,namespace)
+        fn = namespace['trace']
+        fn.addrs = [pc for kind,pc,opcode in trace if opcode is not None and kind != 'exit']
+        fn.source = source
+        return fn
+
+    # follows the code from entry into a list of (kind, pc, opcode) where kind
+    # is 'op' (inline), 'call' (through the interpreter's handler), 'skip',
+    # 'jump', 'loop' (jump back to entry), 'back' (falling through into the
+    # entry, not an instruction), 'last' (handler then leave, for writes that
+    # may modify code) or 'exit' (leave before executing pc)
+    def trace(self,entry):
+        memory = self.emulator.memory
+        trace  = []
+        seen   = set()
+        pc     = entry
+        while True:
+            if pc == entry and trace:
+                trace.append(('back',pc,None))
+                return trace
+            if len(trace) == TRACE_SIZE or pc in seen or pc >= len(memory) - 1:
+                trace.append(('exit',pc,None))
+                return trace
+            seen.add(pc)
+            opcode = (memory[pc] << 8) | memory[pc+1]
+            kind = classify(opcode)
+            if kind == 'jump':
+                target = opcode & 0x0fff
+                if target == entry:
+                    trace.append(('loop',pc,opcode))
+                    return trace
+                trace.append(('jump',pc,opcode))
+                pc = target
+                continue
+            trace.append((kind,pc,opcode))
+            if kind in ('exit','last'):
+                return trace
+            pc += 2
+
+    # writes the python source of a trace
+    def generate(self,entry,trace):
+        length = sum(1 for kind,pc,opcode in trace if kind not in ('exit','back'))
+        quirks = self.emulator.quirks
+        used, dirty = registers(trace,quirks)
+        I_dirty = any(writes_I(opcode,quirks) for kind,pc,opcode in trace if opcode is not None)
+
+        load  = [f"{REGS[r]} = V[{r}]" for r in used] + ["I = emu.I"]
+        flush = [f"V[{r}] = {REGS[r]}" for r in dirty]
+        if I_dirty:
+            flush.append("emu.I = I")
+
+        timers = any(touches_timers(opcode) for kind,pc,opcode in trace if kind == 'op')
+        if timers:
+            # instructions from entry until the next timer tick is due
+            load.append(f"due = (emu.ticks + 1) * {self.emulator.cycles_per_frame} - cycles")
+
+        lines = ["def trace(budget,cycles):"]
+        lines += [f"    {line}" for line in load]
+        lines.append("    n = 0")
+        lines.append(f"    while n + {length} <= budget:")
+        body = []
+
+        # a loop whose iteration leaves every register as it found it will
+        # repeat that iteration exactly until a timer tick or key changes
+        # what it reads, so those iterations are skipped in one step
+        idle = trace[-1][0] in ('loop','back') and all(idles(kind,opcode) for kind,pc,opcode in trace)
+        if idle:
+            state = [REGS[r] for r in dirty] + (["I"] if I_dirty else []) + (["due"] if timers else [])
+            body += [f"s_{name} = {name}" for name in state]
+
+        # leaves the trace after count instructions with pc at target
+        def leave(indent,count,target):
+            pad = " " * indent
+            out = []
+            if count:
+                out.append(f"{pad}n += {count}")
+            out += [f"{pad}{line}" for line in flush]
+            out.append(f"{pad}emu.pc = 0x{target:03x}")
+            out.append(f"{pad}return n")
+            return out
+
+        for i,(kind,pc,opcode) in enumerate(trace):
+            if opcode is not None:
+                body.append(f"# 0x{pc:03x}  0x{opcode:04x}")
+            if kind == 'op':
+                if touches_timers(opcode):
+                    # apply the ticks that are due before this instruction
+                    body.append(f"if n + {i} >= due:")
+                    body.append(f"    emu.catch_up(cycles + n + {i})")
+                    body.append(f"    due = (emu.ticks + 1) * {self.emulator.cycles_per_frame} - cycles")
+                body += inline(opcode,flag_dead(trace,i,quirks),quirks)
+            elif kind in ('call','last'):
+                body += [f"V[{r}] = {REGS[r]}" for r in dirty]
+                body.append("emu.I = I")
+                body.append(f"op_{opcode:04x}()")
+                body += [f"{REGS[r]} = V[{r}]" for r in used]
+                body.append("I = emu.I")
+                if kind == 'last':
+                    body += leave(0,i + 1,pc + 2)
+            elif kind == 'skip':
+                body.append(f"if {condition(opcode)}:")
+                body += leave(4,i + 1,pc + 4)
+            elif kind == 'exit':
+                body += leave(0,i,pc)
+            elif kind in ('loop','back'):
+                if idle:
+                    same = " and ".join(f"{name} == s_{name}" for name in state) or "True"
+                    body.append(f"if {same}:")
+                    # full iterations that still fit after this one
+                    body.append(f"    skip = (budget - n) // {length} - 1")
+                    if timers:
+                        # ...and whose timer reads all come before the next tick
+                        last = max(j for j,(k,a,o) in enumerate(trace) if k == 'op' and touches_timers(o))
+                        body.append(f"    skip = min(skip,(due - 1 - {last} - n - {length}) // {length} + 1)")
+                    body.append("    if skip > 0:")
+                    body.append(f"        n += skip * {length}")
+                body.append(f"n += {length}")
+        lines += [f"        {line}" for line in body]
+        lines += [f"    {line}" for line in flush]
+        lines.append(f"    emu.pc = 0x{entry:03x}")
+        lines.append("    return n")
+        return "\n".join(lines) + "\n"
+
+
+# how the jit handles an opcode, by handler id. everything else is inlined
+KINDS = {
+    CLS : 'call', DRW : 'call', SCD : 'call', SCR : 'call', SCL : 'call', LOW : 'call', HIGH : 'call',
+    LD_HF : 'call', LD_R : 'call', LD_V_R : 'call',
+    RET : 'exit', CALL : 'exit', JP_V0 : 'exit', LD_K : 'exit', EXIT : 'exit',
+    JP  : 'jump',
+    SE  : 'skip', SNE : 'skip', SE_V : 'skip', SNE_V : 'skip', SKP : 'skip', SKNP : 'skip',
+    LD_B : 'last', LD_MEM : 'last',
+}
+
+
+# how the jit handles an opcode
+def classify(opcode):
+    h = INSTRUCTIONS[opcode].handler
+    # malformed 5XYN raises in the interpreter
+    if h == INVALID and opcode >> 12 == 0x5:
+        return 'exit'
+    return KINDS.get(h,'op')
+
+
+# whether a trace item only reads registers, memory, timers and keys and only
+# writes registers, so repeating it with the same inputs changes nothing
+def idles(kind,opcode):
+    if kind in ('jump','loop','back','skip'):
+        return True
+    if kind != 'op':
+        return False
+    cmd = opcode >> 12
+    return cmd != 0xc and not (cmd == 0xf and (opcode & 0xff) in (0x15,0x18))
+
+
+# python condition for a skip instruction to be taken
+def condition(opcode):
+    x   = REGS[(opcode & 0x0f00) >> 8]
+    y   = REGS[(opcode & 0x00f0) >> 4]
+    nn  = opcode & 0x00ff
+    cmd = opcode >> 12
+    if cmd == 0x3:
+        return f"{x} == {nn}"
+    if cmd == 0x4:
+        return f"{x} != {nn}"
+    if cmd == 0x5:
+        return f"{x} == {y}"
+    if cmd == 0x9:
+        return f"{x} != {y}"
+    if nn == 0x9e:
+        return f"keypresses[{x} & 0xf] == 1"
+    return f"keypresses[{x} & 0xf] != 1"
+
+
+# python statements for an inline opcode under the emulator's quirks. flag
+# updates are folded into the arithmetic and dropped when a later
+# instruction overwrites VF unread
+def inline(opcode,flag_dead,quirks):
+    x   = REGS[(opcode & 0x0f00) >> 8]
+    y   = REGS[(opcode & 0x00f0) >> 4]
+    n   = opcode & 0x000f
+    nn  = opcode & 0x00ff
+    nnn = opcode & 0x0fff
+    vf  = REGS[0xf]
+    cmd = opcode >> 12
+    if cmd == 0x6:
+        return [f"{x} = {nn}"]
+    if cmd == 0x7:
+        return [f"{x} = ({x} + {nn}) & 0xff"]
+    if cmd == 0x8:
+        if n == 0x0:
+            return [f"{x} = {y}"]
+        if n in (0x1,0x2,0x3):
+            logic = [f"{x} {({0x1 : '|=', 0x2 : '&=', 0x3 : '^='})[n]} {y}"]
+            if quirks.vf_reset and not flag_dead:
+                logic.append(f"{vf} = 0")
+            return logic
+        if n in (0x4,0x5,0x7):
+            expr = {0x4 : f"{x} + {y}", 0x5 : f"{x} - {y}", 0x7 : f"{y} - {x}"}[n]
+            if flag_dead:
+                return [f"{x} = ({expr}) & 0xff"]
+            # carry is t >> 8 (0 or 1), no borrow is 1 + (t >> 8) (1 or 0)
+            flag = "t >> 8" if n == 0x4 else "1 + (t >> 8)"
+            return [f"t = {expr}", f"{x} = t & 0xff", f"{vf} = {flag}"]
+        # the shift quirk shifts VX in place
+        src = x if quirks.shift else y
+        if n == 0x6:
+            if flag_dead:
+                return [f"{x} = {src} >> 1"]
+            return [f"t = {src} & 1", f"{x} = {src} >> 1", f"{vf} = t"]
+        if n == 0xe:
+            if flag_dead:
+                return [f"{x} = ({src} << 1) & 0xff"]
+            return [f"t = {src} >> 7", f"{x} = ({src} << 1) & 0xff", f"{vf} = t"]
+        return ["pass"]
+    if cmd == 0xa:
+        return [f"I = {nnn}"]
+    if cmd == 0xc:
+        return [f"{x} = randint(0,255) & {nn}"]
+    if cmd == 0xf:
+        if nn == 0x07:
+            return [f"{x} = emu.delay_timer & 0xff"]
+        if nn == 0x15:
+            return [f"emu.delay_timer = {x}"]
+        if nn == 0x18:
+            return [f"emu.sound_timer = {x}"]
+        if nn == 0x1e:
+            return [f"I += {x}"]
+        if nn == 0x29:
+            return [f"I = emu.font_base + ({x} * 5)"]
+        if nn == 0x65:
+            count = ((opcode & 0x0f00) >> 8) + 1
+            names = ", ".join(REGS[:count])
+            check = f"if I + {count} > 4096: raise IndexError('FX65 reads past the end of memory')"
+            if quirks.increment:
+                return [check, f"{names}, = memory[I:I+{count}]", f"I += {count}"]
+            return [check, f"{names}, = memory[I:I+{count}]"]
+    return ["pass"]
+
+
+# registers read and written by an opcode
+def operands(opcode,quirks):
+    x   = (opcode & 0x0f00) >> 8
+    y   = (opcode & 0x00f0) >> 4
+    n   = opcode & 0x000f
+    nn  = opcode & 0x00ff
+    cmd = opcode >> 12
+    if cmd in (0x3,0x4) or cmd == 0xe:
+        return {x}, set()
+    if cmd in (0x5,0x9):
+        return {x,y}, set()
+    if cmd in (0x6,0xc):
+        return set(), {x}
+    if cmd == 0x7:
+        return {x}, {x}
+    if cmd == 0x8:
+        if n == 0x0:
+            return {y}, {x}
+        if n in (0x1,0x2,0x3):
+            return {x,y}, {x,0xf} if quirks.vf_reset else {x}
+        if n in (0x4,0x5,0x7):
+            return {x,y}, {x,0xf}
+        if n in (0x6,0xe):
+            return {x} if quirks.shift else {y}, {x,0xf}
+        return set(), set()
+    if cmd == 0xd:
+        return {x,y}, {0xf}
+    if cmd == 0xf:
+        if nn == 0x07:
+            return set(), {x}
+        if nn in (0x15,0x18,0x1e,0x29,0x30,0x33):
+            return {x}, set()
+        if nn == 0x75:
+            return set(range(x+1)), set()
+        if nn == 0x85:
+            return set(), set(range(x+1))
+        if nn == 0x55:
+            return set(range(x+1)), set()
+        if nn == 0x65:
+            return set(), set(range(x+1))
+    return set(), set()
+
+
+# registers a trace loads into locals and registers it writes back
+def registers(trace,quirks):
+    used, dirty = set(), set()
+    for kind,pc,opcode in trace:
+        if opcode is None or kind in ('exit','jump','loop'):
+            continue
+        reads, writes = operands(opcode,quirks)
+        used |= reads | writes
+        dirty |= writes
+    return sorted(used), sorted(dirty)
+
+
+def touches_timers(opcode):
+    return (opcode >> 12) == 0xf and (opcode & 0xff) in (0x07,0x15,0x18)
+
+
+def writes_I(opcode,quirks):
+    cmd = opcode >> 12
+    if cmd == 0xf and (opcode & 0xff) == 0x65:
+        return quirks.increment
+    return cmd == 0xa or (cmd == 0xf and (opcode & 0xff) in (0x1e,0x29))
+
+
+# whether VF written by trace[i] is overwritten before anything can observe it
+def flag_dead(trace,i,quirks):
+    for kind,pc,opcode in trace[i+1:]:
+        if kind == 'jump':
+            continue
+        if kind != 'op':
+            return False
+        reads, writes = operands(opcode,quirks)
+        if 0xf in reads:
+            return False
+        if 0xf in writes:
+            return True
+    return False
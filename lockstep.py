@@ -0,0 +1,367 @@
+import struct
+
+from emulator import CYCLES_PER_FRAME, FONTS, BIG_FONTS, STATE, STATE_VERSION
+from quirks import CHIP8
+
+# numpy is only needed for lockstep execution
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# call stack depth of each machine
+STACK_SIZE = 16
+
+
+# Many Chip 8 machines advanced together, one instruction on every machine
+# per step. Each machine's registers, memory, stack and display are one row
+# of a numpy array. A step fetches every machine's opcode, groups the
+# machines by opcode class (the high nibble) and runs each group as a few
+# array operations, so the per-instruction interpreter cost is paid once
+# per group rather than once per machine.
+#
+# Instructions behave as in Emulator.decode, with the same quirks. Where
+# the Emulator would raise (a 5XYN with N != 0, an empty or full stack, pc
+# or a memory access past the end of memory) the machine crashes instead:
+# it is marked dead in alive, its pc is left on the failing instruction and
+# it stops running while the others carry on.
+#
+# The display stays 64x32: SUPER-CHIP's resolution and scroll instructions
+# are ignored and DXY0 draws nothing.
+#
+# Machines start from the same rom. Fuzzers can write into memory rows and
+# set keypresses/pressed per machine between steps
+class Lockstep():
+    def __init__(self,rom_bytes,count,seed=None,cycles_per_frame=CYCLES_PER_FRAME,quirks=CHIP8):
+        if np is None:
+            raise RuntimeError("numpy is required for lockstep execution")
+        self.rom    = rom_bytes
+        self.count  = count
+        self.memory = np.zeros((count,4096),np.uint8)
+        self.V      = np.zeros((count,16),np.uint8)
+        self.I      = np.zeros(count,np.int32)
+        self.pc     = np.full(count,0x200,np.int32)
+        self.stack  = np.zeros((count,STACK_SIZE),np.int32)
+        self.sp     = np.zeros(count,np.int32)
+        self.flags  = np.zeros((count,16),np.uint8)
+        self.loaded = False
+
+        # Display, one row of pixels per machine: grid[i, y * width + x]
+        self.width  = 64
+        self.height = 32
+        self.grid   = np.ones((count,self.width * self.height),np.uint8)
+        # every sprite byte as 8 pixels
+        self.bits   = np.unpackbits(np.arange(256,dtype=np.uint8)[:,None],axis=1)
+
+        # Keyboard: keys held down per machine, 0 = keyup / 1 = keydown, and
+        # the key pressed since FX0A last asked, -1 if there wasn't one
+        self.keypresses = np.zeros((count,16),np.uint8)
+        self.pressed    = np.full(count,-1,np.int8)
+
+        # Timers, ticked together once per frame of cycles_per_frame instructions
+        self.delay_timer = np.zeros(count,np.int32)
+        self.sound_timer = np.zeros(count,np.int32)
+        self.cycles = 0
+        self.cycles_per_frame = cycles_per_frame
+        self.quirks = quirks
+
+        # machines that haven't crashed
+        self.alive  = np.ones(count,bool)
+        self.lanes  = np.arange(count)
+        self.random = np.random.default_rng(seed)
+        # group handlers by high nibble of the opcode
+        self.classes = [
+            self.system, self.jump, self.call, self.skip_eq,
+            self.skip_ne, self.skip_reg_eq, self.store, self.add,
+            self.alu, self.skip_reg_ne, self.set_I, self.jump_VX if quirks.jump else self.jump_V0,
+            self.rand, self.draw, self.keys, self.misc
+        ]
+
+    # load fonts and rom into every machine's memory
+    def load(self,base=0x200,font=0x50):
+        assert(base >= 0x200 and base <= self.memory.shape[1] - len(self.rom))
+        fonts = FONTS + BIG_FONTS
+        assert(font >= 0x0 and font <= (0x200 - len(fonts)) )
+        self.rom_base  = base
+        self.font_base = font
+        self.memory[:,font:font+len(fonts)] = fonts
+        self.memory[:,base:base+len(self.rom)] = np.frombuffer(self.rom,np.uint8)
+        self.pc[:] = base
+        self.loaded = True
+
+    # runs every live machine for a number of instructions
+    def run(self,cycles):
+        assert( self.loaded == True )
+        for _ in range(cycles):
+            self.step()
+
+    # executes one instruction on every live machine
+    def step(self):
+        lanes = self.lanes if self.alive.all() else np.flatnonzero(self.alive)
+        pc = self.pc[lanes]
+        outside = pc > 0xffe
+        if outside.any():
+            self.alive[lanes[outside]] = False
+            lanes = lanes[~outside]
+            pc = pc[~outside]
+        memory = self.memory
+        opcode = (memory[lanes,pc].astype(np.int32) << 8) | memory[lanes,pc + 1]
+        self.pc[lanes] = pc + 2
+
+        # sort machines by opcode class and hand each class its slice
+        cmd    = opcode >> 12
+        order  = np.argsort(cmd,kind='stable')
+        counts = np.bincount(cmd,minlength=16)
+        bounds = np.concatenate(([0],np.cumsum(counts)))
+        for c in np.flatnonzero(counts):
+            group = order[bounds[c]:bounds[c+1]]
+            self.classes[c](lanes[group],opcode[group])
+
+        self.cycles += 1
+        if self.cycles % self.cycles_per_frame == 0:
+            self.tick_timers()
+
+    # decrements every machine's delay and sound timers
+    def tick_timers(self):
+        self.delay_timer[self.delay_timer > 0] -= 1
+        self.sound_timer[self.sound_timer > 0] -= 1
+
+    # stops machines on the instruction they just failed to execute
+    def crash(self,lanes):
+        self.alive[lanes] = False
+        self.pc[lanes] -= 2
+
+    # skips the next instruction on machines where cond holds
+    def skip(self,lanes,cond):
+        self.pc[lanes[cond]] += 2
+
+    # 00E0 clears the screen, 00EE returns, 00FD re-executes itself forever,
+    # 0NNN and unknowns are ignored
+    def system(self,lanes,opcode):
+        self.grid[lanes[opcode == 0x00e0]] = 0
+        self.pc[lanes[opcode == 0x00fd]] -= 2
+        lanes = lanes[opcode == 0x00ee]
+        empty = self.sp[lanes] == 0
+        self.crash(lanes[empty])
+        lanes = lanes[~empty]
+        self.sp[lanes] -= 1
+        self.pc[lanes] = self.stack[lanes,self.sp[lanes]]
+
+    # 1NNN
+    def jump(self,lanes,opcode):
+        self.pc[lanes] = opcode & 0xfff
+
+    # 2NNN
+    def call(self,lanes,opcode):
+        full = self.sp[lanes] == STACK_SIZE
+        self.crash(lanes[full])
+        lanes  = lanes[~full]
+        opcode = opcode[~full]
+        sp = self.sp[lanes]
+        self.stack[lanes,sp] = self.pc[lanes]
+        self.sp[lanes] = sp + 1
+        self.pc[lanes] = opcode & 0xfff
+
+    # 3XNN
+    def skip_eq(self,lanes,opcode):
+        self.skip(lanes,self.V[lanes,opcode >> 8 & 0xf] == (opcode & 0xff))
+
+    # 4XNN
+    def skip_ne(self,lanes,opcode):
+        self.skip(lanes,self.V[lanes,opcode >> 8 & 0xf] != (opcode & 0xff))
+
+    # 5XY0
+    def skip_reg_eq(self,lanes,opcode):
+        malformed = (opcode & 0xf) != 0
+        self.crash(lanes[malformed])
+        lanes  = lanes[~malformed]
+        opcode = opcode[~malformed]
+        V = self.V
+        self.skip(lanes,V[lanes,opcode >> 8 & 0xf] == V[lanes,opcode >> 4 & 0xf])
+
+    # 6XNN
+    def store(self,lanes,opcode):
+        self.V[lanes,opcode >> 8 & 0xf] = opcode & 0xff
+
+    # 7XNN
+    def add(self,lanes,opcode):
+        x = opcode >> 8 & 0xf
+        self.V[lanes,x] = (self.V[lanes,x] + (opcode & 0xff)) & 0xff
+
+    # 8XYN, every operation is computed for every machine and each keeps its own
+    def alu(self,lanes,opcode):
+        V  = self.V
+        x  = opcode >> 8 & 0xf
+        n  = opcode & 0xf
+        vx = V[lanes,x].astype(np.int32)
+        vy = V[lanes,opcode >> 4 & 0xf].astype(np.int32)
+        # the shift quirk shifts VX in place
+        shifted = vx if self.quirks.shift else vy
+        val = np.select(
+            [n == 0x0, n == 0x1, n == 0x2, n == 0x3, n == 0x4, n == 0x5, n == 0x6, n == 0x7, n == 0xe],
+            [vy, vx | vy, vx & vy, vx ^ vy, vx + vy, vx - vy, shifted >> 1, vy - vx, shifted << 1],
+            vx)
+        logic = (n == 0x1) | (n == 0x2) | (n == 0x3) if self.quirks.vf_reset else np.zeros(len(n),bool)
+        flag = np.select(
+            [n == 0x4, (n == 0x5) | (n == 0x7), n == 0x6, n == 0xe, logic],
+            [val > 0xff, val >= 0, shifted & 1, shifted >> 7, 0],
+            -1)
+        V[lanes,x] = val & 0xff
+        flagged = flag >= 0
+        V[lanes[flagged],0xf] = flag[flagged]
+
+    # 9XY0, a 9XYN with N != 0 is ignored
+    def skip_reg_ne(self,lanes,opcode):
+        valid  = (opcode & 0xf) == 0
+        lanes  = lanes[valid]
+        opcode = opcode[valid]
+        V = self.V
+        self.skip(lanes,V[lanes,opcode >> 8 & 0xf] != V[lanes,opcode >> 4 & 0xf])
+
+    # ANNN
+    def set_I(self,lanes,opcode):
+        self.I[lanes] = opcode & 0xfff
+
+    # BNNN
+    def jump_V0(self,lanes,opcode):
+        self.pc[lanes] = (opcode & 0xfff) + self.V[lanes,0]
+
+    # BXNN with the jump quirk
+    def jump_VX(self,lanes,opcode):
+        self.pc[lanes] = (opcode & 0xfff) + self.V[lanes,opcode >> 8 & 0xf]
+
+    # CXNN, every machine draws its own number
+    def rand(self,lanes,opcode):
+        self.V[lanes,opcode >> 8 & 0xf] = self.random.integers(0,256,len(lanes)) & opcode & 0xff
+
+    # DXYN, XORs the sprites a row at a time across all drawing machines.
+    # sprites wrap around the screen edges like blit(), or are clipped at
+    # them like clip_blit() with the clip quirk
+    def draw(self,lanes,opcode):
+        V      = self.V
+        memory = self.memory
+        grid   = self.grid
+        width  = self.width
+        height = self.height
+        n    = opcode & 0xf
+        clip = self.quirks.clip
+        top  = V[lanes,opcode >> 4 & 0xf].astype(np.int32) % height
+        columns = V[lanes,opcode >> 8 & 0xf].astype(np.int32)[:,None] % width + np.arange(8)
+        # clipped pixels are drawn as 0, which leaves the grid as it is
+        visible = columns < width if clip else True
+        columns %= width
+        I    = self.I[lanes]
+        rows = lanes[:,None]
+        hit  = np.zeros(len(lanes),bool)
+        for row in range(n.max()):
+            addr = I + row
+            # like memory[I:I+n], rows past the end of memory are empty
+            valid  = (row < n) & (addr < 4096)
+            if clip:
+                valid &= top + row < height
+            sprite = np.where(valid,memory[lanes,addr & 0xfff],0)
+            bits   = self.bits[sprite] & visible
+            pixels = ((top + row) % height)[:,None] * width + columns
+            old    = grid[rows,pixels]
+            hit   |= (old & bits).any(axis=1)
+            grid[rows,pixels] = old ^ bits
+        V[lanes,0xf] = hit
+
+    # EX9E and EXA1
+    def keys(self,lanes,opcode):
+        nn   = opcode & 0xff
+        down = self.keypresses[lanes,self.V[lanes,opcode >> 8 & 0xf] & 0xf] == 1
+        self.skip(lanes,(down & (nn == 0x9e)) | (~down & (nn == 0xa1)))
+
+    # FXNN, each operation runs on the machines that have it
+    def misc(self,lanes,opcode):
+        V  = self.V
+        I  = self.I
+        x  = opcode >> 8 & 0xf
+        nn = opcode & 0xff
+        for op in np.unique(nn):
+            has = nn == op
+            sel = lanes[has]
+            sx  = x[has]
+            if op == 0x07:
+                V[sel,sx] = self.delay_timer[sel] & 0xff
+            # waits for a keypress, re-executing until one arrives
+            elif op == 0x0a:
+                key = self.pressed[sel]
+                waiting = key < 0
+                self.pc[sel[waiting]] -= 2
+                V[sel[~waiting],sx[~waiting]] = key[~waiting]
+                self.pressed[sel] = -1
+            elif op == 0x15:
+                self.delay_timer[sel] = V[sel,sx]
+            elif op == 0x18:
+                self.sound_timer[sel] = V[sel,sx]
+            elif op == 0x1e:
+                I[sel] += V[sel,sx]
+            elif op == 0x29:
+                I[sel] = self.font_base + V[sel,sx].astype(np.int32) * 5
+            elif op == 0x30:
+                I[sel] = self.font_base + len(FONTS) + V[sel,sx].astype(np.int32) * 10
+            elif op == 0x33:
+                self.bcd(sel,sx)
+            elif op == 0x55:
+                self.save(sel,sx)
+            elif op == 0x65:
+                self.restore_registers(sel,sx)
+            # FX75 and FX85 copy V0..VX to and from the RPL flags
+            elif op == 0x75:
+                for r in range(sx.max() + 1):
+                    m = r <= sx
+                    self.flags[sel[m],r] = V[sel[m],r]
+            elif op == 0x85:
+                for r in range(sx.max() + 1):
+                    m = r <= sx
+                    V[sel[m],r] = self.flags[sel[m],r]
+
+    # FX33
+    def bcd(self,lanes,x):
+        outside = self.I[lanes] + 3 > 4096
+        self.crash(lanes[outside])
+        lanes = lanes[~outside]
+        x     = x[~outside]
+        val = self.V[lanes,x]
+        I   = self.I[lanes]
+        self.memory[lanes,I]   = val // 100
+        self.memory[lanes,I+1] = (val // 10) % 10
+        self.memory[lanes,I+2] = val % 10
+
+    # FX55
+    def save(self,lanes,x):
+        outside = self.I[lanes] + x + 1 > 4096
+        self.crash(lanes[outside])
+        lanes = lanes[~outside]
+        x     = x[~outside]
+        I = self.I[lanes]
+        for r in range(x.max(initial=-1) + 1):
+            m = r <= x
+            self.memory[lanes[m],I[m] + r] = self.V[lanes[m],r]
+        if self.quirks.increment:
+            self.I[lanes] = I + x + 1
+
+    # FX65
+    def restore_registers(self,lanes,x):
+        outside = self.I[lanes] + x + 1 > 4096
+        self.crash(lanes[outside])
+        lanes = lanes[~outside]
+        x     = x[~outside]
+        I = self.I[lanes]
+        for r in range(x.max(initial=-1) + 1):
+            m = r <= x
+            self.V[lanes[m],r] = self.memory[lanes[m],I[m] + r]
+        if self.quirks.increment:
+            self.I[lanes] = I + x + 1
+
+    # one machine's state in the Emulator.snapshot() format, so it can be
+    # restored into an Emulator to inspect, replay or draw it. machines share
+    # one numpy rng, so there is no rng state and restoring keeps the Emulator's
+    def snapshot(self,i):
+        depth  = int(self.sp[i])
+        header = STATE.pack(STATE_VERSION,self.cycles,int(self.pc[i]),int(self.I[i]) & 0xffff,
+                            int(self.delay_timer[i]),int(self.sound_timer[i]),depth,0,0)
+        stack  = struct.pack(f">{depth}H",*(int(addr) for addr in self.stack[i,:depth]))
+        return b"".join((header,stack,self.V[i].tobytes(),self.flags[i].tobytes(),self.memory[i].tobytes(),self.grid[i].tobytes()))
@@ -1,6 +1,72 @@
 import argparse
+import hashlib
+import math
+import random
+import sys
 
 from emulator import Emulator
+from frontend import HeadlessFrontend
+from movie import Movie, Recorder, ReplayFrontend, rom_digest
+from capture import Capture, RawSink, HashSink, PngSink, GifSink
+from debugger import Debugger
+from profiler import Profiler
+from tracelog import TraceLog, parse_patterns, parse_range
+from quirks import PROFILES
+from rewind import Rewind
+from romcache import RomCache
+
+
+# parses a --speed value: "max", a multiplier like "2x" of the normal 60
+# frames/s, or a fixed rate of instructions/s like "5000" or "5000ips".
+# returns (rate, unit) with unit "x" or "ips", and rate None for max
+def parse_speed(speed):
+    if speed == "max":
+        return (None,"x")
+    unit = "x" if speed.endswith("x") else "ips"
+    try:
+        rate = float(speed[:-len(unit)] if speed.endswith(unit) else speed)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid speed {speed!r}, use max, a multiplier like 2x or instructions/s like 5000")
+    if not (rate > 0 and math.isfinite(rate)):
+        raise argparse.ArgumentTypeError("speed must be above 0, use max for no throttling")
+    return (rate,unit)
+
+
+# emulated frames per host second of a parsed --speed, None for no throttling
+def frames_per_second(speed,ipf):
+    rate, unit = speed
+    if rate is None:
+        return None
+    return 60 * rate if unit == "x" else rate / ipf
+
+
+# frame capture sinks asked for on the command line
+def capture_sinks(args):
+    sinks = []
+    if args.capture_raw:
+        sinks.append(RawSink(args.capture_raw))
+    if args.capture_hashes:
+        sinks.append(HashSink(args.capture_hashes))
+    if args.capture_png:
+        sinks.append(PngSink(args.capture_png))
+    if args.capture_gif:
+        sinks.append(GifSink(args.capture_gif))
+    return sinks
+
+
+# replays a movie headless and prints a hash of the final machine state, so
+# runs of the same movie can be compared. everything that affects the run
+# comes from the movie
+def replay(data,movie,speed,stats,sinks):
+    frontend = ReplayFrontend(movie,fps=frames_per_second(speed,movie.cycles_per_frame),stats=stats)
+    emulator = Emulator(data,frontend=frontend,cycles_per_frame=movie.cycles_per_frame,seed=movie.seed,quirks=movie.quirks)
+    emulator.load(base=movie.rom_base,font=movie.font_base)
+    capture = Capture(emulator,sinks) if sinks else None
+    emulator.loop(movie.cycles())
+    if capture is not None:
+        capture.close()
+    print(f"{len(movie.frames)} frames  state {hashlib.blake2b(emulator.snapshot(),digest_size=8).hexdigest()}")
+    print(frontend.summary())
 
 
 if __name__ == '__main__':
@@ -10,10 +76,91 @@ if __name__ == '__main__':
     parser.add_argument("--rom_base",type=int,default=0x200,help="base address for rom to be loaded into")
     parser.add_argument("--font_base",type=int,default=0x0,help="base address for font to be loaded into")
     parser.add_argument("-d",action='store_true',default=False,help="debug mode")
+    parser.add_argument("--capture_raw",default=None,help="write every frame's pixels to a raw stream file")
+    parser.add_argument("--capture_hashes",default=None,help="write a 64-bit hash of every frame to a file, one per line")
+    parser.add_argument("--capture_png",default=None,help="write every frame as a PNG into a directory")
+    parser.add_argument("--capture_gif",default=None,help="write every frame into an animated GIF")
+    parser.add_argument("--debugger",action='store_true',default=False,help="start in the interactive debugger (breakpoints, watchpoints, stepping)")
+    parser.add_argument("--quirks",choices=sorted(PROFILES),default="chip8",help="interpreter behaviours the rom expects (default: chip8)")
+    parser.add_argument("--ipf",type=int,default=50,help="instructions per 60 Hz frame")
+    parser.add_argument("--speed",type=parse_speed,default=None,help="max, a multiplier like 2x, or instructions/s like 5000 (default: 1x, max when headless)")
+    parser.add_argument("--stats",action='store_true',default=False,help="show instructions/s, frames/s and cpu time")
+    parser.add_argument("--headless",action='store_true',default=False,help="run without a window")
+    parser.add_argument("--cycles",type=int,default=None,help="stop after this many instructions")
+    parser.add_argument("--rewind",type=float,default=0,help="seconds of history to keep, hold backspace to rewind")
+    parser.add_argument("--seed",type=int,default=None,help="seed for random numbers (CXNN)")
+    parser.add_argument("--cache",default=None,help="directory to cache rom analysis and compiled code in across runs")
+    parser.add_argument("--record",default=None,help="record the keys pressed each frame into a movie file")
+    parser.add_argument("--replay",default=None,help="replay a movie file headless, unthrottled unless --speed is given")
+    parser.add_argument("--profile",action='store_true',default=False,help="count instructions and host time per opcode and address, report at exit")
+    parser.add_argument("--flamegraph",default=None,help="with --profile, write call stacks in folded format (for flamegraph.pl) to a file")
+    parser.add_argument("--trace",default=None,help="log every instruction to a file, as JSON lines if it ends in .jsonl, else binary")
+    parser.add_argument("--trace_ring",type=int,default=None,help="with --trace, only keep the last this many records")
+    parser.add_argument("--trace_pcs",type=parse_range,default=None,help="with --trace, only log addresses in a range like 0x200-0x2ff")
+    parser.add_argument("--trace_ops",type=parse_patterns,default=None,help="with --trace, only log opcodes like DXYN,2NNN")
     args = parser.parse_args()
+    if args.record and args.rewind:
+        parser.error("--record can't be used with --rewind")
+    if args.record and args.debugger:
+        parser.error("--record can't be used with --debugger")
+    if args.trace and args.profile:
+        parser.error("--trace can't be used with --profile")
+    if args.debugger and (args.trace or args.profile):
+        parser.error("--debugger can't be used with --trace or --profile")
 
     with open(args.rom,"rb") as f:
         data = f.read()
-    emulator = Emulator(data,debug=args.d)
+    if args.replay:
+        movie = Movie.load(args.replay)
+        if movie.digest != rom_digest(data):
+            parser.error(f"{args.replay} was recorded on a different rom")
+        replay(data,movie,args.speed or parse_speed("max"),args.stats,capture_sinks(args))
+        sys.exit()
+    if args.headless:
+        fps = frames_per_second(args.speed or parse_speed("max"),args.ipf)
+        frontend = HeadlessFrontend(fps=fps,stats=args.stats)
+    else:
+        from frontend import PygameFrontend
+        fps = frames_per_second(args.speed or parse_speed("1x"),args.ipf)
+        frontend = PygameFrontend(fps=fps,stats=args.stats)
+    if args.record:
+        # a recording needs a known seed to replay
+        seed = args.seed if args.seed is not None else random.getrandbits(32)
+        movie = Movie(data,seed,args.ipf,args.rom_base,args.font_base,PROFILES[args.quirks])
+        frontend = Recorder(frontend,movie)
+    else:
+        seed = args.seed
+    cache = RomCache(args.cache) if args.cache else None
+    emulator = Emulator(data,debug=args.d,frontend=frontend,cycles_per_frame=args.ipf,seed=seed,cache=cache,
+                        quirks=PROFILES[args.quirks])
     emulator.load(base=args.rom_base,font=args.font_base)
-    emulator.loop()
\ No newline at end of file
+    if args.rewind > 0:
+        emulator.history = Rewind(emulator,depth=max(1,round(args.rewind * 60)))
+    profiler = Profiler(emulator) if args.profile else None
+    tracelog = None
+    if args.trace:
+        jsonl = args.trace.endswith(".jsonl")
+        tracelog = TraceLog(emulator,open(args.trace,"w" if jsonl else "wb"),jsonl=jsonl,
+                            ring=args.trace_ring,pcs=args.trace_pcs,handlers=args.trace_ops)
+    sinks = capture_sinks(args)
+    capture = Capture(emulator,sinks) if sinks else None
+    try:
+        if args.debugger:
+            Debugger(emulator).cmdloop()
+        else:
+            emulator.loop(args.cycles)
+    finally:
+        emulator.save_cache()
+        if capture is not None:
+            capture.close()
+        if tracelog is not None:
+            tracelog.close()
+        if profiler is not None:
+            print(profiler.report())
+            if args.flamegraph:
+                with open(args.flamegraph,"w") as f:
+                    f.write(profiler.folded())
+        if args.record:
+            movie.save(args.record)
+        if args.stats:
+            print(frontend.summary())
\ No newline at end of file
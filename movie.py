@@ -0,0 +1,119 @@
+import hashlib
+import struct
+
+from frontend import HeadlessFrontend
+from quirks import Quirks, CHIP8
+
+# movie header: magic, format version, rng seed, instructions per frame, rom
+# and font base addresses, the quirks as a bitmask (bit i = Quirks field i)
+# and a hash of the rom
+MOVIE = struct.Struct(">4sBQHHHB16s")
+MOVIE_MAGIC   = b"C8MV"
+MOVIE_VERSION = 2
+# per frame: keys held down as a bitmask (bit k = chip8 key k) and the key
+# FX0A got that frame, NO_KEY if it got none
+FRAME  = struct.Struct(">HB")
+NO_KEY = 0xff
+
+
+# hash identifying the rom a movie was recorded on
+def rom_digest(rom_bytes):
+    return hashlib.blake2b(rom_bytes,digest_size=16).digest()
+
+
+# An input movie: everything needed to replay a session exactly. Running
+# the rom from a fresh Emulator with the same seed, instructions per frame,
+# base addresses and quirks and feeding it the keys of each frame reproduces it
+class Movie():
+    def __init__(self,rom_bytes,seed,cycles_per_frame,rom_base=0x200,font_base=0x50,quirks=CHIP8):
+        self.digest = rom_digest(rom_bytes)
+        self.seed   = seed
+        self.cycles_per_frame = cycles_per_frame
+        self.rom_base  = rom_base
+        self.font_base = font_base
+        self.quirks    = quirks
+        # (held key mask, FX0A key) per frame
+        self.frames = []
+
+    # reads a movie written by save()
+    @classmethod
+    def load(cls,path):
+        with open(path,"rb") as f:
+            data = f.read()
+        magic,version,seed,cycles_per_frame,rom_base,font_base,mask,digest = MOVIE.unpack_from(data)
+        assert( magic == MOVIE_MAGIC and version == MOVIE_VERSION )
+        quirks = Quirks(*(bool(mask >> i & 1) for i in range(len(Quirks._fields))))
+        movie = cls(b"",seed,cycles_per_frame,rom_base,font_base,quirks)
+        movie.digest = digest
+        movie.frames = list(FRAME.iter_unpack(data[MOVIE.size:]))
+        return movie
+
+    def save(self,path):
+        mask   = sum(1 << i for i,quirk in enumerate(self.quirks) if quirk)
+        header = MOVIE.pack(MOVIE_MAGIC,MOVIE_VERSION,self.seed,self.cycles_per_frame,
+                            self.rom_base,self.font_base,mask,self.digest)
+        with open(path,"wb") as f:
+            f.write(header)
+            f.write(b"".join(FRAME.pack(*frame) for frame in self.frames))
+
+    # instructions the recorded frames run
+    def cycles(self):
+        return len(self.frames) * self.cycles_per_frame
+
+
+# Wraps a frontend and records the keys it gives the emulator each frame
+# into a movie, everything else goes to the wrapped frontend
+class Recorder():
+    def __init__(self,frontend,movie):
+        self.frontend = frontend
+        self.movie    = movie
+        self.key      = None
+
+    def __getattr__(self,name):
+        return getattr(self.frontend,name)
+
+    def attach(self,emulator):
+        self.emulator = emulator
+        self.frontend.attach(emulator)
+
+    def poll(self):
+        self.frontend.poll()
+        self.key = None
+
+    def wait_key(self):
+        key = self.frontend.wait_key()
+        if key is not None:
+            self.key = key
+        return key
+
+    def present(self):
+        self.frontend.present()
+
+    # the frame is over, its input is final
+    def tick(self):
+        keypresses = self.emulator.keypresses
+        held = sum(1 << key for key in keypresses if keypresses[key])
+        self.movie.frames.append((held,NO_KEY if self.key is None else self.key))
+        self.frontend.tick()
+
+
+# feeds a movie's keys back frame by frame without a window, unthrottled
+# unless an fps is given. after the last frame every key stays up
+class ReplayFrontend(HeadlessFrontend):
+    def __init__(self,movie,fps=None,stats=False):
+        HeadlessFrontend.__init__(self,fps,stats)
+        self.movie = movie
+        self.key   = None
+
+    def poll(self):
+        keypresses = self.emulator.keypresses
+        frames = self.movie.frames
+        held, key = frames[self.frames] if self.frames < len(frames) else (0,NO_KEY)
+        for k in keypresses:
+            keypresses[k] = (held >> k) & 1
+        self.key = None if key == NO_KEY else key
+
+    def wait_key(self):
+        key = self.key
+        self.key = None
+        return key
@@ -0,0 +1,102 @@
+import time
+
+from decoder import INSTRUCTIONS, MNEMONICS, PATTERNS, CALL, RET, text
+
+
+# Counts instructions and host time per opcode class (handler id), per pc
+# and per call stack. Attaching replaces the emulator's run() with an
+# instrumented loop that steps one instruction at a time and times every
+# handler, the same way debug mode swaps in trace_step(). The normal run()
+# is untouched, so an emulator without a profiler pays nothing for it.
+#
+# Call stacks follow 2NNN and 00EE: the root frame is the rom's entry point
+# and each call adds a frame named after the subroutine it calls
+class Profiler():
+    def __init__(self,emulator):
+        self.emulator = emulator
+        self.counts = [0] * 4096
+        self.times  = [0] * 4096
+        self.class_counts = [0] * len(PATTERNS)
+        self.class_times  = [0] * len(PATTERNS)
+        # (instructions, host ns) per call stack, a tuple of frame names
+        self.stacks = {}
+        self.frames = ("main",)
+        emulator.run = self.run
+
+    # puts the emulator's own run() back
+    def detach(self):
+        del self.emulator.run
+
+    # runs for a number of instructions like Emulator.run, profiling each one
+    def run(self,cycles):
+        emu    = self.emulator
+        assert( emu.loaded == True )
+        memory = emu.memory
+        ops    = emu.ops
+        counts = self.counts
+        times  = self.times
+        class_counts = self.class_counts
+        class_times  = self.class_times
+        stacks = self.stacks
+        frames = self.frames
+        clock  = time.perf_counter_ns
+        n      = emu.cycles
+        target = n + cycles
+        while n < target:
+            pc = emu.pc
+            opcode = (memory[pc] << 8) | memory[pc+1]
+            emu.pc = pc + 2
+            op = ops.get(opcode)
+            if op is None:
+                op = emu.decode(opcode)
+            start = clock()
+            op()
+            elapsed = clock() - start
+            n += 1
+            emu.cycles = n
+            emu.catch_up(n)
+
+            h = INSTRUCTIONS[opcode].handler
+            counts[pc] += 1
+            times[pc]  += elapsed
+            class_counts[h] += 1
+            class_times[h]  += elapsed
+            entry = stacks.get(frames)
+            stacks[frames] = (1,elapsed) if entry is None else (entry[0] + 1,entry[1] + elapsed)
+            if h == CALL:
+                frames = frames + (f"sub_{emu.pc:03x}",)
+            elif h == RET and len(frames) > 1:
+                frames = frames[:-1]
+        self.frames = frames
+
+    # text report: instructions and host time per opcode class, then the
+    # hottest addresses with what they hold now
+    def report(self,top=20):
+        memory = self.emulator.memory
+        total  = max(sum(self.class_counts),1)
+        lines  = [f"{'class':<6} {'':<5} {'count':>12} {'%':>6} {'ms':>10} {'ns/op':>8}"]
+        order  = sorted(range(len(PATTERNS)),key=lambda h: -self.class_times[h])
+        for h in order:
+            count = self.class_counts[h]
+            if count:
+                elapsed = self.class_times[h]
+                lines.append(f"{PATTERNS[h]:<6} {MNEMONICS[h]:<5} {count:>12,} {100 * count / total:>6.2f} "
+                             f"{elapsed / 1e6:>10.2f} {elapsed / count:>8.0f}")
+        lines.append("")
+        lines.append(f"{'pc':<6} {'count':>12} {'%':>6} {'ms':>10}  instruction")
+        for pc in self.hot(top):
+            opcode = (memory[pc] << 8) | memory[pc+1]
+            lines.append(f"0x{pc:03x}  {self.counts[pc]:>12,} {100 * self.counts[pc] / total:>6.2f} "
+                         f"{self.times[pc] / 1e6:>10.2f}  {opcode:04x}  {text(opcode)}")
+        return "\n".join(lines)
+
+    # the most executed addresses, hottest first
+    def hot(self,top=20):
+        executed = [pc for pc,count in enumerate(self.counts) if count]
+        return sorted(executed,key=lambda pc: -self.counts[pc])[:top]
+
+    # call stacks in the folded format flamegraph.pl and speedscope read:
+    # "main;sub_2d4 1234" per line, weighted by instructions or host ns
+    def folded(self,weight="count"):
+        index = 0 if weight == "count" else 1
+        return "".join(f"{';'.join(frames)} {value[index]}\n" for frames,value in sorted(self.stacks.items()))
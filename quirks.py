@@ -0,0 +1,24 @@
+from collections import namedtuple
+
+# Behaviours that differ between Chip 8 interpreters, and that roms written
+# for one of them rely on:
+#   shift     8XY6/8XYE shift VX in place instead of shifting VY into VX
+#   jump      BNNN jumps to XNN + VX instead of NNN + V0
+#   increment FX55/FX65 leave I pointing past the last register moved
+#   clip      sprites are clipped at the screen edges instead of wrapping
+#   vf_reset  8XY1/8XY2/8XY3 reset VF to 0
+#   sprite16  DXY0 draws a 16x16 sprite instead of nothing
+#
+# The emulator picks its handlers by these when it builds the dispatch
+# table, so a profile costs nothing per instruction
+Quirks = namedtuple("Quirks","shift jump increment clip vf_reset sprite16")
+
+# the COSMAC VIP interpreter
+CHIP8  = Quirks(shift=False,jump=False,increment=True,clip=True,vf_reset=True,sprite16=False)
+# SUPER-CHIP 1.1 on the HP 48
+SCHIP  = Quirks(shift=True,jump=True,increment=False,clip=True,vf_reset=False,sprite16=True)
+# XO-CHIP, as in Octo
+XOCHIP = Quirks(shift=False,jump=False,increment=True,clip=False,vf_reset=False,sprite16=True)
+
+# profiles by the name main.py's --quirks takes
+PROFILES = { "chip8" : CHIP8, "schip" : SCHIP, "xochip" : XOCHIP }
@@ -0,0 +1,92 @@
+import zlib
+from collections import deque
+
+from_bytes = int.from_bytes
+
+# frames kept by default, 10 seconds at 60 Hz
+REWIND_DEPTH = 600
+# a fresh keyframe every this many frames
+KEYFRAME_INTERVAL = 60
+
+
+# Rewind history of an emulator: a ring buffer holding a snapshot per frame.
+# Every interval frames the snapshot is kept whole as a keyframe, the frames
+# in between are stored as the zlib compressed XOR against their keyframe,
+# which is mostly zeros since little of the machine changes in a frame.
+# Once depth frames are held the oldest is evicted for each new one. Deltas
+# keep their keyframe alive, so memory stays bounded by depth deltas plus
+# depth / interval + 1 keyframes
+class Rewind():
+    def __init__(self,emulator,depth=REWIND_DEPTH,interval=KEYFRAME_INTERVAL):
+        assert( depth > 0 and interval > 0 )
+        self.emulator = emulator
+        self.interval = interval
+        # (keyframe, length, delta) per frame, oldest first. delta is None
+        # for the keyframes themselves
+        self.frames   = deque(maxlen=depth)
+        self.keyframe = None
+        self.since    = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    # saves the emulator's current state as the newest frame
+    def record(self):
+        state = self.emulator.snapshot()
+        if self.keyframe is None or self.since == self.interval:
+            self.keyframe = state
+            self.since    = 0
+            self.frames.append((state,len(state),None))
+        else:
+            self.frames.append((self.keyframe,len(state),delta(self.keyframe,state)))
+        self.since += 1
+
+    # restores the state from frames ago (1 = the last one recorded), dropping
+    # every newer frame. returns False without changing anything if the history
+    # isn't that long
+    def rewind(self,frames=1):
+        if frames > len(self.frames) or frames < 1:
+            return False
+        for _ in range(frames - 1):
+            self.frames.pop()
+        self.emulator.restore(self.state(self.frames[-1]))
+        # later frames keep building on the restored state's keyframe
+        self.keyframe = self.frames[-1][0]
+        self.since    = sum(1 for frame in self.frames if frame[0] is self.keyframe)
+        return True
+
+    # steps back one frame, keeping the restored frame as the newest so that
+    # rewinding again goes further back. returns False once history runs out
+    def back(self):
+        if len(self.frames) < 2:
+            return False
+        self.frames.pop()
+        return self.rewind(1)
+
+    # full snapshot of a stored frame
+    def state(self,frame):
+        keyframe, length, changes = frame
+        if changes is None:
+            return keyframe
+        return apply(keyframe,length,changes)
+
+    # bytes used by the stored frames, counting each keyframe once
+    def size(self):
+        keyframes = { id(frame[0]) : len(frame[0]) for frame in self.frames }
+        return sum(keyframes.values()) + sum(len(frame[2]) for frame in self.frames if frame[2] is not None)
+
+
+# compressed XOR of a snapshot against its keyframe. snapshots differ in
+# length with the stack depth, the shorter one is zero padded
+def delta(keyframe,state):
+    size = max(len(keyframe),len(state))
+    diff = from_bytes(keyframe,'big') << 8 * (size - len(keyframe)) ^ from_bytes(state,'big') << 8 * (size - len(state))
+    return zlib.compress(diff.to_bytes(size,'big'),1)
+
+
+# the snapshot of the given length that delta() turned into changes
+def apply(keyframe,length,changes):
+    diff = zlib.decompress(changes)
+    size = len(diff)
+    state = from_bytes(keyframe,'big') << 8 * (size - len(keyframe)) ^ from_bytes(diff,'big')
+    return (state >> 8 * (size - length)).to_bytes(length,'big')
@@ -0,0 +1,228 @@
+import hashlib
+import importlib.util
+import marshal
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from analyzer import Analysis
+
+# cache file header: magic, format version, number of traces and the length
+# of the marshaled analysis that follows it
+HEADER = struct.Struct(">4sBII")
+CACHE_MAGIC   = b"C8RC"
+CACHE_VERSION = 1
+# trace index entry after the analysis: entry pc, trace signature and the
+# offset and length of its marshaled (source, code object)
+TRACE = struct.Struct(">HQII")
+# default bound on the total size of the cache directory
+MAX_BYTES = 64 * 1024 * 1024
+# temporary files older than this (seconds) were left by a writer that died
+STALE_TEMP = 3600
+
+
+# signature of a followed trace, the (kind, pc, opcode) list the jit
+# generates code from. with the cache key it decides the generated code
+def signature(trace):
+    return int.from_bytes(hashlib.blake2b(marshal.dumps(trace),digest_size=8).digest(),'big')
+
+
+# key of a rom's cache entry. code objects are marshaled per python
+# version, so it's part of the key
+def cache_key(rom_bytes,rom_base,cycles_per_frame,quirks):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(bytes(rom_bytes))
+    h.update(struct.pack(">HIB",rom_base,cycles_per_frame,CACHE_VERSION))
+    h.update(bytes(quirks))
+    h.update(importlib.util.MAGIC_NUMBER)
+    return h.hexdigest()
+
+
+# One cached rom, read through a read-only mmap of its file. The analysis is
+# loaded up front and traces only when the jit asks for them, so workers
+# running the same rom share the file's pages
+class Entry():
+    def __init__(self,path):
+        with open(path,"rb") as f:
+            self.data = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        magic, version, count, length = HEADER.unpack_from(self.data)
+        assert( magic == CACHE_MAGIC and version == CACHE_VERSION )
+        offset = HEADER.size
+        # Analysis.state() of the rom
+        self.analysis = marshal.loads(self.data[offset:offset+length])
+        offset += length
+        # (offset, length) of each trace by (entry, signature)
+        self.index = {}
+        for i in range(count):
+            entry, sig, start, size = TRACE.unpack_from(self.data,offset)
+            self.index[(entry,sig)] = (start,size)
+            offset += TRACE.size
+
+    # (source, code object) of a compiled trace, None if it isn't cached
+    def trace(self,entry,sig):
+        where = self.index.get((entry,sig))
+        if where is None:
+            return None
+        start, size = where
+        return marshal.loads(self.data[start:start+size])
+
+    # marshaled (source, code object) of every trace by (entry, signature)
+    def traces(self):
+        return { key : self.data[start:start+size] for key,(start,size) in self.index.items() }
+
+    def close(self):
+        self.data.close()
+
+
+# Content-addressed cache of what loading and running a rom works out: its
+# static analysis and the jit's compiled traces. One file per key in a
+# directory, where the key hashes the rom bytes, rom_base, the quirks and
+# everything else generated code depends on.
+#
+# Any number of processes can share the directory. Files are written to a
+# temporary name and renamed into place, so readers only ever see whole
+# files, and mapped files stay readable after being replaced or evicted.
+# Reading a file marks it used, the least recently used files are evicted
+# once the directory grows past max_bytes
+class RomCache():
+    def __init__(self,path,max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path,exist_ok=True)
+
+    def key(self,rom_bytes,rom_base,cycles_per_frame,quirks):
+        return cache_key(rom_bytes,rom_base,cycles_per_frame,quirks)
+
+    def file(self,key):
+        return os.path.join(self.path,key + ".c8c")
+
+    # the cached entry for a key, None on a miss. unreadable files are dropped
+    def get(self,key):
+        path = self.file(key)
+        try:
+            entry = Entry(path)
+        except FileNotFoundError:
+            return None
+        except (AssertionError,ValueError,EOFError,TypeError,struct.error):
+            self.remove(path)
+            return None
+        # mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    # writes an entry: the analysis and {(entry, signature): (source, code)}
+    # of compiled traces, keeping the traces already in the file for the key
+    def put(self,key,analysis,traces):
+        blobs = {}
+        old = self.get(key)
+        if old is not None:
+            blobs.update(old.traces())
+            old.close()
+        for sig,artifact in traces.items():
+            blobs[sig] = marshal.dumps(artifact)
+        state  = marshal.dumps(analysis.state())
+        offset = HEADER.size + len(state) + TRACE.size * len(blobs)
+        index  = []
+        for (entry,sig),blob in blobs.items():
+            index.append(TRACE.pack(entry,sig,offset,len(blob)))
+            offset += len(blob)
+        data = b"".join([HEADER.pack(CACHE_MAGIC,CACHE_VERSION,len(blobs),len(state)),state] + index + list(blobs.values()))
+
+        fd, temp = tempfile.mkstemp(dir=self.path,suffix=".tmp")
+        try:
+            with os.fdopen(fd,"wb") as f:
+                f.write(data)
+            os.replace(temp,self.file(key))
+        except OSError:
+            self.remove(temp)
+            return
+        self.evict()
+
+    # removes the least recently used files until the cache fits max_bytes
+    def evict(self):
+        files = []
+        now = time.time()
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path,name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name.endswith(".tmp") and now - st.st_mtime > STALE_TEMP:
+                self.remove(path)
+            elif name.endswith(".c8c"):
+                files.append((st.st_mtime,st.st_size,path))
+        total = sum(size for mtime,size,path in files)
+        for mtime,size,path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
+
+    # another process may have removed it first
+    def remove(self,path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# A cached rom held in memory, see MemoryCache
+class MemoryEntry():
+    def __init__(self,analysis,index):
+        self.analysis = analysis
+        # (source, code object) by (entry, signature)
+        self.index = index
+        # traces the disk cache has
+        self.saved = len(index)
+
+    def trace(self,entry,sig):
+        return self.index.get((entry,sig))
+
+
+# Cache for the emulators of one process running the same roms, like the
+# sessions of server.py. share() makes a loaded emulator's jit keep what it
+# compiles in the entry for its rom, so code one emulator compiled is there
+# for the others right away instead of being compiled again by each. With a
+# RomCache behind it entries are read from disk on first use, and save()
+# writes back what was compiled since
+class MemoryCache():
+    def __init__(self,disk=None):
+        self.disk = disk
+        self.entries = {}
+
+    def key(self,rom_bytes,rom_base,cycles_per_frame,quirks):
+        return cache_key(rom_bytes,rom_base,cycles_per_frame,quirks)
+
+    # the entry for a key, None if neither memory nor disk has it
+    def get(self,key):
+        entry = self.entries.get(key)
+        if entry is None and self.disk is not None:
+            cached = self.disk.get(key)
+            if cached is not None:
+                entry = MemoryEntry(cached.analysis,{ sig : cached.trace(*sig) for sig in cached.index })
+                self.entries[key] = entry
+                cached.close()
+        return entry
+
+    # has an emulator loaded with this cache share its rom's entry
+    def share(self,emulator):
+        key = emulator.cache_key
+        if key not in self.entries:
+            self.entries[key] = MemoryEntry(emulator.analysis.state(),{})
+        emulator.cached = self.entries[key]
+        if emulator.jit is not None:
+            emulator.jit.artifacts = emulator.cached.index
+
+    # writes an entry to the disk cache if it has traces the disk doesn't
+    def save(self,key):
+        entry = self.entries.get(key)
+        if self.disk is None or entry is None or len(entry.index) == entry.saved:
+            return
+        self.disk.put(key,Analysis(b"",0,entry.analysis),entry.index)
+        entry.saved = len(entry.index)
@@ -0,0 +1,341 @@
+import argparse
+import asyncio
+import heapq
+import struct
+import time
+from collections import deque
+
+from batch import halt_reason
+from emulator import Emulator
+from frontend import HeadlessFrontend, FRAME_TIME
+from movie import FRAME, NO_KEY
+from quirks import Quirks
+from romcache import RomCache, MemoryCache
+
+# every message is its kind and the length of the payload that follows
+MESSAGE = struct.Struct(">BH")
+# client to server. HELLO starts a session: a SESSION header and the rom.
+# KEYS is a FRAME from movie.py: the keys held as a bitmask and a key
+# pressed for FX0A, NO_KEY if none
+HELLO = 1
+KEYS  = 2
+# server to client. DELTA is a DELTA_HEADER and the rows that changed since
+# the last DELTA, each its row number and the row's pixels packed 8 to a
+# byte, leftmost pixel in the high bit. END is why the session ended, text
+DELTA = 3
+END   = 4
+# rng seed, instructions per frame and the quirks as a bitmask (bit i =
+# Quirks field i), like in a movie
+SESSION = struct.Struct(">QHB")
+# frame number, display width and height. a resolution change sends every row
+DELTA_HEADER = struct.Struct(">IBB")
+
+# pixel bytes to the digits of a binary number
+BITS = bytes.maketrans(b"\x00\x01",b"01")
+# unsent bytes a client may fall behind by before its frames are skipped
+MAX_BUFFERED = 64 * 1024
+# latency samples kept per session
+SAMPLES = 600
+# a session more than this late (seconds) stops trying to catch up
+MAX_LATE = 0.25
+
+
+def send(writer,kind,payload):
+    writer.write(MESSAGE.pack(kind,len(payload)) + payload)
+
+
+# (kind, payload) of the next message
+async def receive(reader):
+    kind, length = MESSAGE.unpack(await reader.readexactly(MESSAGE.size))
+    return kind, await reader.readexactly(length)
+
+
+# value at a fraction of the way through samples, 0 if there are none
+def percentile(samples,fraction):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1,int(len(samples) * fraction))]
+
+
+# Frontend of a remote session: keys come from KEYS messages and frames go
+# out as DELTAs of the rows that changed. While the client isn't reading
+# fast enough frames are skipped, the next DELTA sent covers them
+class SessionFrontend(HeadlessFrontend):
+    def __init__(self,writer):
+        HeadlessFrontend.__init__(self)
+        self.writer = writer
+        self.held   = 0
+        # FX0A keys received and not handed out yet, the one for this frame
+        self.presses = deque()
+        self.key     = None
+        # arrival times of input not applied yet, and of input applied this frame
+        self.arrivals = []
+        self.applied  = []
+        # seconds from input arriving to the end of the frame it was applied in
+        self.latency  = deque(maxlen=SAMPLES)
+
+    def attach(self,emulator):
+        HeadlessFrontend.attach(self,emulator)
+        # copy of the grid as last sent, 0xff so the first frame sends everything
+        self.shown = bytearray(b"\xff" * len(emulator.grid))
+
+    # a KEYS message arrived
+    def input(self,held,key):
+        self.held = held
+        if key != NO_KEY:
+            self.presses.append(key)
+        self.arrivals.append(time.perf_counter())
+
+    # applies the last held keys and one FX0A key per frame
+    def poll(self):
+        keypresses = self.emulator.keypresses
+        for k in keypresses:
+            keypresses[k] = (self.held >> k) & 1
+        self.key = self.presses.popleft() if self.presses else None
+        self.applied, self.arrivals = self.arrivals, []
+
+    def wait_key(self):
+        key = self.key
+        self.key = None
+        return key
+
+    def present(self):
+        if self.applied:
+            now = time.perf_counter()
+            self.latency.extend(now - arrival for arrival in self.applied)
+        emulator = self.emulator
+        grid  = emulator.grid
+        shown = self.shown
+        if grid == shown or self.writer.transport.get_write_buffer_size() > MAX_BUFFERED:
+            return
+        width  = emulator.width
+        height = emulator.height
+        if len(shown) != len(grid):
+            shown[:] = b"\xff" * len(grid)
+        parts = [DELTA_HEADER.pack(self.frames,width,height)]
+        for row in range(height):
+            i = row * width
+            line = grid[i:i+width]
+            if line != shown[i:i+width]:
+                parts.append(bytes([row]) + int(line.translate(BITS),2).to_bytes(width // 8,'big'))
+        shown[:] = grid
+        send(self.writer,DELTA,b"".join(parts))
+
+
+# One client's emulator, run a frame at a time by the server
+class Session():
+    def __init__(self,number,rom_bytes,seed,cycles_per_frame,quirks,writer,cache):
+        self.number   = number
+        self.writer   = writer
+        self.cache    = cache
+        self.frontend = SessionFrontend(writer)
+        self.emulator = Emulator(rom_bytes,frontend=self.frontend,cycles_per_frame=cycles_per_frame,seed=seed,
+                                 cache=cache,quirks=quirks)
+        self.emulator.load()
+        cache.share(self.emulator)
+        # host time the session started and its next frame is due
+        self.started    = time.perf_counter()
+        self.next_frame = self.started
+        # seconds each frame started after it was due
+        self.lateness = deque(maxlen=SAMPLES)
+        # why the session ended, None while it runs
+        self.ended = None
+
+    # runs the frame due, or ends the session if the rom fails or exits
+    def frame(self,now):
+        self.lateness.append(now - self.next_frame)
+        try:
+            self.emulator.frame()
+            if halt_reason(self.emulator) == "exit":
+                self.end("exit")
+                return
+        except Exception as e:
+            self.end(f"{type(e).__name__}: {e}")
+            return
+        self.next_frame += FRAME_TIME
+        if now - self.next_frame > MAX_LATE:
+            # fell too far behind, don't try to catch up in a burst
+            self.next_frame = now
+
+    def end(self,reason):
+        if self.ended is not None:
+            return
+        self.ended = reason
+        self.cache.save(self.emulator.cache_key)
+        if not self.writer.is_closing():
+            send(self.writer,END,reason.encode())
+            self.writer.close()
+
+    def report(self):
+        lateness = self.lateness
+        latency  = self.frontend.latency
+        frames = self.frontend.frames
+        return (f"session {self.number:<5} {frames:>8} frames {frames / max(time.perf_counter() - self.started,1e-9):>5.1f}/s  "
+                f"late p50 {1000 * percentile(lateness,0.5):.2f}ms p99 {1000 * percentile(lateness,0.99):.2f}ms  "
+                f"input p50 {1000 * percentile(latency,0.5):.2f}ms p99 {1000 * percentile(latency,0.99):.2f}ms"
+                f"  {self.ended or 'running'}")
+
+
+# Hosts many sessions in one process. Every session runs at 60 frames/s of
+# host time, one frame per turn. The scheduler always runs the session whose
+# frame has been due the longest, so under load all sessions slow down
+# alike instead of some starving, and it gives the event loop a turn after
+# every frame so input and deltas keep flowing.
+#
+# Sessions running the same rom share the code the jit compiled for it
+# through a MemoryCache, backed by a RomCache on disk if one is given.
+#
+# cpu caps the share of one core the emulation may use: cpu time to spend
+# on frames accrues at that rate and the scheduler sleeps once it's spent
+class Server():
+    def __init__(self,cpu=1.0,cache=None,stats=False):
+        assert( 0 < cpu <= 1 )
+        self.cpu      = cpu
+        self.cache    = MemoryCache(cache)
+        self.stats    = stats
+        self.sessions = {}
+        self.count    = 0
+        # (next frame due, number) of every running session
+        self.due      = []
+        self.wake     = asyncio.Event()
+        # frames run and cpu seconds spent running them in total
+        self.frames   = 0
+        self.busy     = 0.0
+        self.started  = (time.perf_counter(),time.process_time(),0,0.0)
+        self.last     = self.started
+
+    # one client connection, for the life of its session
+    async def handle(self,reader,writer):
+        try:
+            kind, payload = await receive(reader)
+            assert( kind == HELLO )
+            seed, cycles_per_frame, mask = SESSION.unpack_from(payload)
+            quirks = Quirks(*(bool(mask >> i & 1) for i in range(len(Quirks._fields))))
+            self.count += 1
+            session = Session(self.count,payload[SESSION.size:],seed,cycles_per_frame,quirks,writer,self.cache)
+        except (AssertionError,struct.error,asyncio.IncompleteReadError,ConnectionError) as e:
+            if not writer.is_closing():
+                send(writer,END,f"bad session: {type(e).__name__}".encode())
+                writer.close()
+            return
+        self.sessions[session.number] = session
+        heapq.heappush(self.due,(session.next_frame,session.number))
+        self.wake.set()
+        try:
+            while session.ended is None:
+                kind, payload = await receive(reader)
+                if kind == KEYS:
+                    session.frontend.input(*FRAME.unpack(payload))
+        except (struct.error,asyncio.IncompleteReadError,ConnectionError):
+            pass
+        session.end(session.ended or "disconnected")
+        del self.sessions[session.number]
+        if self.stats:
+            print(session.report())
+
+    # runs the sessions' frames as they come due, forever
+    async def schedule(self):
+        due    = self.due
+        clock  = time.perf_counter
+        budget = 0.0
+        last   = clock()
+        while True:
+            if not due:
+                self.wake.clear()
+                await self.wake.wait()
+                last = clock()
+                continue
+            now = clock()
+            # unused time doesn't pile up into a burst
+            budget = min(budget + (now - last) * self.cpu,FRAME_TIME)
+            last = now
+            if budget <= 0:
+                await asyncio.sleep(-budget / self.cpu)
+                continue
+            next_frame, number = due[0]
+            if next_frame > now:
+                # a new session is due right away, don't oversleep it
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(),next_frame - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(due)
+            session = self.sessions.get(number)
+            if session is None or session.ended is not None:
+                continue
+            cpu = time.thread_time()
+            # one failing session must never stop the others
+            try:
+                session.frame(now)
+            except Exception as e:
+                session.end(f"{type(e).__name__}: {e}")
+            spent = time.thread_time() - cpu
+            budget     -= spent
+            self.busy  += spent
+            self.frames += 1
+            if session.ended is None:
+                heapq.heappush(due,(session.next_frame,number))
+            await asyncio.sleep(0)
+
+    # sessions, frames/s, cpu use and how many sessions one core could run
+    # at 60 frames/s at the host time per frame seen, all since a
+    # (wall time, cpu time, frames, busy seconds) mark
+    def readout(self,since):
+        wall   = max(time.perf_counter() - since[0],1e-9)
+        cpu    = time.process_time() - since[1]
+        frames = self.frames - since[2]
+        busy   = self.busy - since[3]
+        per_core = frames / cpu / 60 if cpu > 0 else 0.0
+        return (f"{len(self.sessions)} sessions  {frames / wall:,.0f} frames/s  "
+                f"{100 * busy / wall:.0f}% emulating  {100 * cpu / wall:.0f}% cpu  {per_core:,.0f} sessions/core")
+
+    # prints a readout about once a second
+    async def monitor(self):
+        while True:
+            await asyncio.sleep(1)
+            print(self.readout(self.last))
+            self.last = (time.perf_counter(),time.process_time(),self.frames,self.busy)
+
+    def report(self):
+        lines = [session.report() for session in self.sessions.values()]
+        lines.append(self.readout(self.started))
+        return "\n".join(lines)
+
+    async def serve(self,host,port):
+        server = await asyncio.start_server(self.handle,host,port)
+        tasks = [asyncio.ensure_future(self.schedule())]
+        if self.stats:
+            tasks.append(asyncio.ensure_future(self.monitor()))
+        print(f"serving on {', '.join(str(sock.getsockname()) for sock in server.sockets)}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            # let the connections see their sessions end instead of being cancelled
+            for session in list(self.sessions.values()):
+                session.end("server shut down")
+            await asyncio.sleep(0)
+
+
+if __name__ == '__main__':
+    # argument parsing
+    parser = argparse.ArgumentParser(description="Host Chip 8 sessions for remote players")
+    parser.add_argument("--host",default="127.0.0.1",help="address to listen on")
+    parser.add_argument("--port",type=int,default=8088,help="port to listen on")
+    parser.add_argument("--cpu",type=float,default=1.0,help="share of one core the emulation may use, like 0.5 (default: 1)")
+    parser.add_argument("--cache",default=None,help="directory to cache rom analysis and compiled code in")
+    parser.add_argument("--stats",action='store_true',default=False,help="print load every second and every session's latency when it ends")
+    args = parser.parse_args()
+
+    server = Server(cpu=args.cpu,cache=RomCache(args.cache) if args.cache else None,stats=args.stats)
+    try:
+        asyncio.run(server.serve(args.host,args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(server.report())
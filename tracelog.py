@@ -0,0 +1,169 @@
+import argparse
+import json
+import struct
+import sys
+from collections import deque
+
+from decoder import INSTRUCTIONS, PATTERNS
+from disassembler import Disassembler
+
+# binary trace file header: magic and format version
+HEADER = struct.Struct(">4sB")
+TRACE_MAGIC   = b"C8TR"
+TRACE_VERSION = 1
+# binary record: instruction index, pc, opcode, I after the instruction and a
+# mask of the registers it changed (bit r = Vr), followed by one byte with the
+# new value of each changed register
+RECORD = struct.Struct(">QHHHH")
+# records buffered before they are written out
+FLUSH_SIZE = 8192
+
+
+# "0x200-0x2ff" as the range(start, end + 1) of addresses it covers
+def parse_range(text):
+    start, _, end = text.partition("-")
+    start = int(start,0)
+    return range(start,int(end,0) + 1 if end else start + 1)
+
+
+# "DXYN,2NNN" as the set of handler ids with those opcode patterns
+def parse_patterns(text):
+    patterns = [pattern.strip().upper() for pattern in text.split(",")]
+    for pattern in patterns:
+        if pattern not in PATTERNS:
+            raise argparse.ArgumentTypeError(f"unknown opcode pattern {pattern}")
+    return { PATTERNS.index(pattern) for pattern in patterns }
+
+
+# Writes a structured record of every executed instruction: its index, pc,
+# opcode, the registers it changed and I. Records go to a file in large
+# buffered writes, as binary or one JSON object per line, or into a ring
+# buffer that keeps the last ring records and is written out on close().
+# pcs (a range) and handlers (a set of handler ids) limit what is recorded.
+#
+# Like the profiler, attaching replaces the emulator's run() with a loop
+# that steps an instruction at a time, so the normal run() pays nothing
+class TraceLog():
+    def __init__(self,emulator,out,jsonl=False,ring=None,pcs=None,handlers=None):
+        self.emulator = emulator
+        self.out      = out
+        self.jsonl    = jsonl
+        self.pcs      = pcs if pcs is not None else range(0x10000)
+        self.wanted   = [handlers is None or h in handlers for h in range(len(PATTERNS))]
+        self.records  = deque(maxlen=ring) if ring else []
+        self.ring     = bool(ring)
+        if not jsonl:
+            out.write(HEADER.pack(TRACE_MAGIC,TRACE_VERSION))
+        emulator.run = self.run
+
+    # puts the emulator's own run() back and writes out what is buffered
+    def detach(self):
+        del self.emulator.run
+        self.close()
+
+    # runs for a number of instructions like Emulator.run, recording each one
+    def run(self,cycles):
+        emu    = self.emulator
+        assert( emu.loaded == True )
+        memory = emu.memory
+        ops    = emu.ops
+        V      = emu.V
+        pcs    = self.pcs
+        wanted = self.wanted
+        n      = emu.cycles
+        target = n + cycles
+        while n < target:
+            pc = emu.pc
+            opcode = (memory[pc] << 8) | memory[pc+1]
+            emu.pc = pc + 2
+            op = ops.get(opcode)
+            if op is None:
+                op = emu.decode(opcode)
+            before = bytes(V)
+            op()
+            emu.cycles = n + 1
+            emu.catch_up(n + 1)
+            if pc in pcs and wanted[INSTRUCTIONS[opcode].handler]:
+                self.record(n,pc,opcode,before)
+            n += 1
+
+    def record(self,n,pc,opcode,before):
+        V = self.emulator.V
+        I = self.emulator.I & 0xffff
+        changed = [r for r in range(16) if V[r] != before[r]] if V != before else []
+        if self.jsonl:
+            line = json.dumps({ "n" : n, "pc" : pc, "opcode" : opcode, "I" : I,
+                                "V" : { str(r) : V[r] for r in changed } })
+            self.records.append(line + "\n")
+        else:
+            mask = sum(1 << r for r in changed)
+            self.records.append(RECORD.pack(n,pc,opcode,I,mask) + bytes(V[r] for r in changed))
+        if not self.ring and len(self.records) >= FLUSH_SIZE:
+            self.flush()
+
+    # writes buffered records to the file, ring buffers are only written on close()
+    def flush(self):
+        if self.records:
+            self.out.write(("" if self.jsonl else b"").join(self.records))
+            self.records.clear()
+
+    # writes out the ring buffer or what is left buffered and closes the file
+    def close(self):
+        self.flush()
+        self.out.close()
+
+
+# yields the records of a trace file as (n, pc, opcode, I, {register: value})
+def read(path):
+    with open(path,"rb") as f:
+        data = f.read()
+    if data[:len(TRACE_MAGIC)] != TRACE_MAGIC:
+        for line in data.decode().splitlines():
+            if line:
+                record = json.loads(line)
+                yield (record["n"],record["pc"],record["opcode"],record["I"],
+                       { int(r) : value for r,value in record["V"].items() })
+        return
+    magic, version = HEADER.unpack_from(data)
+    assert( version == TRACE_VERSION )
+    offset = HEADER.size
+    while offset < len(data):
+        n, pc, opcode, I, mask = RECORD.unpack_from(data,offset)
+        offset += RECORD.size
+        changed = [r for r in range(16) if mask >> r & 1]
+        yield n, pc, opcode, I, dict(zip(changed,data[offset:offset+len(changed)]))
+        offset += len(changed)
+
+
+# pretty prints trace records, with the rom's labels if it has a disassembler
+def pretty(records,disassembler=None,pcs=None,handlers=None):
+    if disassembler is None:
+        disassembler = Disassembler(b"")
+    labels = disassembler.labels
+    for n, pc, opcode, I, changed in records:
+        if pcs is not None and pc not in pcs:
+            continue
+        if handlers is not None and INSTRUCTIONS[opcode].handler not in handlers:
+            continue
+        if pc in labels:
+            yield f"{labels[pc]}:\n"
+        listing = disassembler.instruction(opcode)
+        registers = " ".join(f"V{r:X}=0x{value:02x}" for r,value in changed.items())
+        yield f"{n:>10}  0x{pc:03x}  {opcode:04x}  {listing:<24} I=0x{I:03x}  {registers}".rstrip() + "\n"
+
+
+if __name__ == '__main__':
+    # argument parsing
+    parser = argparse.ArgumentParser(description="Pretty print a Chip 8 trace file")
+    parser.add_argument("trace",help="trace file written with main.py --trace")
+    parser.add_argument("--rom",default=None,help="rom the trace was recorded on, for labels")
+    parser.add_argument("--rom_base",type=int,default=0x200,help="base address the rom was loaded at")
+    parser.add_argument("--pcs",type=parse_range,default=None,help="only addresses in a range like 0x200-0x2ff")
+    parser.add_argument("--ops",type=parse_patterns,default=None,help="only opcodes like DXYN,2NNN")
+    args = parser.parse_args()
+
+    disassembler = None
+    if args.rom:
+        with open(args.rom,"rb") as f:
+            disassembler = Disassembler(f.read(),args.rom_base)
+    sys.stdout.writelines(pretty(read(args.trace),disassembler,args.pcs,args.ops))